@@ -0,0 +1,457 @@
+# Measures the performance of the bot without a live subreddit.
+# - Generates a synthetic database at a configurable scale: users with long daily streaks (at the same local time,
+#   so their posts cross DST changes), occasional posters, COAD streaks and early deleted posts.
+#   The database is generated once per configuration, and every run works on a fresh copy of it.
+# - Replaces reddit by FakeReddit, a local stand-in for the PRAW objects the bot uses.
+# - Times the streak calculations, the moderation of new posts, the leaderboards and the JSON export,
+#   and appends the results (with the commit) to a JSON lines file, so runs can be compared across commits.
+#
+# Example: python benchmark.py --users 50000 --posts 5000000
+# Only some parts: python benchmark.py --only calculate_streak update_target_post
+
+from chickenbot import ChickenBot, MethodMetrics, timezone_offset_table, title_number_properties
+import numpy as np
+import pandas as pd
+import argparse
+import contextlib
+import subprocess
+import platform
+import sqlite3
+import shutil
+import json
+import time
+import zlib
+import os
+
+DAY = 24*60*60
+
+# Share of the users that post once per day, at about the same local time
+DAILY_POSTER_SHARE = 0.3
+# Chance that a daily poster misses a day
+MISSED_DAY_CHANCE = 0.002
+# Share of the posts that repeat the number of the post before it (approved double counts)
+DUPLICATE_NUMBER_SHARE = 0.01
+# Share of the users that carried over a streak from r/CountOnceADay
+COAD_USER_SHARE = 0.01
+# Number of early deleted posts, relative to the number of posts
+DELETED_POST_SHARE = 0.002
+
+class FakeAuthor:
+    def __init__(self, name):
+        self.name = name
+
+class FakeModeration:
+    def __init__(self, submission):
+        self.submission = submission
+
+    def remove(self):
+        self.submission.reddit.count('remove')
+        self.submission.removed = True
+
+    def send_removal_message(self, text):
+        self.submission.reddit.count('send_removal_message')
+
+class FakeSubmission:
+    def __init__(self, reddit, id, title, author, created_utc):
+        self.reddit = reddit
+        self.id = id
+        self.title = title
+        self.author = FakeAuthor(author) if author is not None else None
+        self.created_utc = created_utc
+        self.approved_by = None
+        self.removed = False
+        self.selftext = ''
+        self.permalink = f"/r/{reddit.subredditname}/comments/{id}/"
+        self.mod = FakeModeration(self)
+        # Stable, but different for every post
+        self.score = zlib.crc32(id.encode()) % 1000
+        self.num_comments = zlib.crc32(id.encode()) % 100
+
+    def edit(self, text):
+        self.reddit.count('edit')
+
+class FakeFlair:
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.flairs = {}
+
+    def __call__(self, redditor = None, limit = None):
+        self.reddit.count('flair')
+        if redditor is not None:
+            return iter([{'user': FakeAuthor(redditor), 'flair_text': self.flairs.get(redditor), 'flair_css_class': None}])
+        return iter([{'user': FakeAuthor(user), 'flair_text': text, 'flair_css_class': None} for user, text in self.flairs.items()])
+
+    def set(self, redditor, text = None):
+        self.reddit.count('flair.set')
+        self.flairs[redditor] = text
+
+    def update(self, changes):
+        self.reddit.count('flair.update')
+        for change in changes:
+            self.flairs[change['user']] = change['flair_text']
+        return [{'ok': True} for _ in changes]
+
+class FakeWikiPage:
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+
+    def edit(self, content, reason = None):
+        self.reddit.count('wiki.edit')
+        self.reddit.wiki_pages[self.name] = content
+
+class FakeWiki:
+    def __init__(self, reddit):
+        self.reddit = reddit
+
+    def __getitem__(self, name):
+        return FakeWikiPage(self.reddit, name)
+
+class FakeSubreddit:
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.flair = FakeFlair(reddit)
+        self.wiki = FakeWiki(reddit)
+
+    def new(self, limit = 100):
+        self.reddit.count('new')
+        return list(reversed(self.reddit.new_posts))[:limit]
+
+class FakeReddit:
+    # Only has the parts of praw.Reddit the bot uses. Posts it doesn't know (e.g. those in the generated database)
+    # are made up when they are asked for. Every call that would be a request to reddit is counted,
+    # and takes latency seconds.
+    def __init__(self, subredditname = 'benchmark', latency = 0):
+        self.subredditname = subredditname
+        self.latency = latency
+        self.submissions = {}
+        self.new_posts = []
+        self.wiki_pages = {}
+        self.requests = {}
+        self.subreddit_object = FakeSubreddit(self)
+
+    def count(self, request):
+        self.requests[request] = self.requests.get(request, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def submit(self, id, title, author, created_utc):
+        # A new post in the subreddit
+        submission = FakeSubmission(self, id, title, author, created_utc)
+        self.submissions[id] = submission
+        self.new_posts.append(submission)
+        return submission
+
+    def get_submission(self, id):
+        if id not in self.submissions:
+            self.submissions[id] = FakeSubmission(self, id, '', 'unknown', 0)
+        return self.submissions[id]
+
+    def submission(self, id = None):
+        self.count('submission')
+        return self.get_submission(id)
+
+    def info(self, fullnames = None):
+        self.count('info')
+        return [self.get_submission(fullname[3:]) for fullname in fullnames]
+
+    def redditor(self, name):
+        return name
+
+    def subreddit(self, name):
+        return self.subreddit_object
+
+def make_bot(db, reddit):
+    # A bot that uses the fake reddit, without asking for the subreddit
+    cb = ChickenBot.__new__(ChickenBot)
+    cb.db = db
+    cb.reddit = reddit
+    cb.subredditname = reddit.subredditname
+    cb.subreddit = reddit.subreddit(reddit.subredditname)
+    cb.current_count_link = f"https://www.reddit.com/r/{reddit.subredditname}/comments/target"
+    cb.target_post = FakeSubmission(reddit, 'target', 'The next number', 'bot', 0)
+    cb.metrics = MethodMetrics()
+    return cb
+
+def base36(number):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    text = ''
+    while True:
+        number, digit = divmod(number, 36)
+        text = digits[digit] + text
+        if number == 0:
+            return text
+
+def utc_timestamps(local_timestamps, timezone):
+    # The UTC timestamps of moments in local time of one of the timezones of timezone_offset_table
+    transitions, offsets = timezone
+    offset = offsets[np.searchsorted(transitions, local_timestamps, side='right') - 1]
+    offset = offsets[np.searchsorted(transitions, local_timestamps - offset, side='right') - 1]
+    return local_timestamps - offset
+
+def generate_posts(rng, users, posts, days, now):
+    # Returns the (username, timestamp) of all posts, sorted by time
+    start = now - days*DAY
+    weights = 1/np.arange(1, users+1)**0.8
+    counts = np.maximum(rng.multinomial(posts, weights/weights.sum()), 1)
+    timezones = timezone_offset_table()
+
+    usernames = []
+    timestamps = []
+    for user, n in enumerate(counts):
+        if n <= days and rng.random() < DAILY_POSTER_SHARE:
+            # A streak of n days, that is still going for half of them
+            day_numbers = np.cumsum(1 + (rng.random(n) < MISSED_DAY_CHANCE))
+            last_day = days - 1 if rng.random() < 0.5 else rng.integers(min(n, days) - 1, days)
+            day_numbers = day_numbers - day_numbers[-1] + last_day
+            day_numbers = day_numbers[day_numbers >= 0]
+            # Around the same time every day, but never past midnight (local time), otherwise the streak would break
+            local_time = np.clip(rng.normal(rng.uniform(6*60*60, 22*60*60), 60*60, len(day_numbers)), 0, DAY - 1)
+            user_timestamps = utc_timestamps(start + day_numbers*DAY + local_time, timezones[rng.integers(len(timezones))])
+        else:
+            user_timestamps = rng.uniform(start, now, n)
+        user_timestamps = user_timestamps[user_timestamps < now]
+        usernames += [f"user{user}"]*len(user_timestamps)
+        timestamps.append(user_timestamps)
+
+    posts = pd.DataFrame({'username': usernames, 'timestamp': np.concatenate(timestamps).astype(np.int64)})
+    return posts.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+def post_streaks(posts):
+    # The number of consecutive (UTC) days each user has posted on, up to each post.
+    # Close enough to the real streaks for the leaderboards, and much faster to calculate.
+    days = posts['timestamp'] // DAY
+    gap = days - days.groupby(posts['username']).shift()
+    streak_number = (gap.isna() | (gap > 1)).groupby(posts['username']).cumsum()
+    return (gap == 1).astype(int).groupby([posts['username'], streak_number]).cumsum() + 1
+
+def generate_database(db, users, posts, days, seed, empty_post_streaks):
+    print(f"Generating a database with {users} users and {posts} posts over {days} days")
+    start = time.time()
+    if os.path.exists(db+'.db'):
+        os.remove(db+'.db')
+    rng = np.random.default_rng(seed)
+    now = int(time.time())
+
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        cb = make_bot(db, FakeReddit())
+        cb.setup_database()
+        cb.close_connection()
+
+    posts = generate_posts(rng, users, posts, days, now)
+    posts['id'] = [base36(i + 36**5) for i in range(len(posts))]
+    numbers = np.arange(1, len(posts) + 1) - np.cumsum(rng.random(len(posts)) < DUPLICATE_NUMBER_SHARE)
+    posts['title'] = numbers.astype(str)
+    posts['upvotes'] = rng.lognormal(3, 1, len(posts)).astype(np.int64)
+    posts['comments'] = rng.poisson(5, len(posts))
+    posts['statistics_updated'] = np.minimum(posts['timestamp'] + 21*DAY, now)
+    streaks = post_streaks(posts)
+    posts['current_streak'] = streaks
+    posts['current_COAD_streak'] = streaks
+    # The newest posts don't have a streak yet, see record_empty_post_streaks
+    if empty_post_streaks > 0:
+        posts.loc[posts.index[-empty_post_streaks:], ['current_streak', 'current_COAD_streak']] = None
+    posts['number'] = numbers
+
+    number_properties = []
+    claimed = set()
+    for id, title in zip(posts['id'], posts['title']):
+        number, trailing_zeroes, identical_digits, palindrome = title_number_properties(title)
+        number_properties.append((id, trailing_zeroes, identical_digits, palindrome, number not in claimed))
+        claimed.add(number)
+
+    usernames = posts['username'].unique()
+    COAD_users = rng.choice(usernames, int(len(usernames)*COAD_USER_SHARE), replace=False)
+    first_posts = posts.groupby('username')['timestamp'].min()
+    COAD_posts = [(user, f"coad{i}", int(rng.integers(1, 1000)), int(first_posts[user] - rng.integers(1, 30)*DAY)) for i, user in enumerate(COAD_users)]
+
+    deleted_users = rng.choice(usernames, int(len(posts)*DELETED_POST_SHARE))
+    deleted_posts = [(f"deleted{i}", user, int(rng.integers(now - days*DAY, now))) for i, user in enumerate(deleted_users)]
+
+    conn = sqlite3.connect(db+'.db')
+    columns = ['id', 'username', 'timestamp', 'title', 'current_streak', 'current_COAD_streak', 'upvotes', 'comments', 'statistics_updated', 'number']
+    conn.executemany(f"INSERT INTO chicken_posts ({', '.join(columns)}) VALUES ({', '.join('?'*len(columns))})",
+                     posts[columns].astype(object).where(posts[columns].notna(), None).itertuples(index=False, name=None))
+    conn.executemany("INSERT INTO number_properties (id, trailing_zeroes, identical_digits, palindrome, first_claim) VALUES (?, ?, ?, ?, ?)", number_properties)
+    conn.executemany("INSERT INTO COAD_posts (username, post_id, streak, timestamp) VALUES (?, ?, ?, ?)", COAD_posts)
+    conn.executemany("INSERT INTO deleted_posts (id, username, timestamp) VALUES (?, ?, ?)", deleted_posts)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    print(f"Generated {len(posts)} posts of {len(usernames)} users in {time.time()-start:.1f}s")
+
+def current_commit():
+    # The commit of the code of the bot, marked if it has uncommitted changes
+    repository = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository, capture_output=True, text=True, check=True).stdout.strip()
+        changed = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository, capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+changes' if changed else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark:
+    def __init__(self, cb, reddit):
+        self.cb = cb
+        self.reddit = reddit
+        self.results = {}
+
+    def measure(self, name, function, calls = 1):
+        # Runs the function (which makes the given number of calls to the bot),
+        # and records the time, the database use and the (fake) reddit requests.
+        self.cb.metrics.reset()
+        requests = self.reddit.total_requests()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            function()
+        seconds = time.perf_counter() - start
+        method = self.cb.metrics.snapshot().get(name, {})
+        self.results[name] = {
+            'seconds': seconds,
+            'calls': calls,
+            'seconds_per_call': seconds/calls,
+            'sql_statements': method.get('sql_statements', 0),
+            'sql_rows': method.get('sql_rows', 0),
+            'reddit_requests': self.reddit.total_requests() - requests
+        }
+        print(f"{name}: {seconds:.3f}s")
+        return self.results[name]
+
+    def calculate_streak(self, sample):
+        # The users with the most posts, and a random sample of the others
+        users = self.cb.get_all_users()
+        posts_per_user = pd.read_sql("SELECT username, COUNT(*) AS posts FROM chicken_posts GROUP BY username ORDER BY posts DESC", self.cb.conn())
+        self.cb.close_connection()
+        rng = np.random.default_rng(0)
+        sampled_users = list(posts_per_user['username'][:sample//2]) + list(rng.choice(users, sample - sample//2))
+        self.measure('calculate_streak', lambda: [self.cb.calculate_streak(user) for user in sampled_users], calls=len(sampled_users))
+
+    def update_target_post(self, new_posts, seed):
+        # New posts come in one by one: mostly the correct number, some wrong numbers,
+        # some that aren't numbers, and some by users who have already posted today.
+        rng = np.random.default_rng(seed)
+        users = self.cb.get_all_users()
+        now = int(time.time())
+        durations = []
+        def moderate():
+            for i in range(new_posts):
+                count = self.cb.get_count_state()['count']
+                kind = rng.random()
+                if kind < 0.85:
+                    title = str(count + 1)
+                elif kind < 0.95:
+                    title = str(count + int(rng.integers(2, 100)))
+                else:
+                    title = 'Not a number'
+                if rng.random() < 0.05 and self.reddit.new_posts:
+                    author = self.reddit.new_posts[-1].author.name
+                else:
+                    author = str(rng.choice(users))
+                self.reddit.submit(f"new{i}", title, author, now - (new_posts - i)*60)
+                start = time.perf_counter()
+                self.cb.update_target_post()
+                durations.append(time.perf_counter() - start)
+        result = self.measure('update_target_post', moderate, calls=new_posts)
+        result['p50'], result['p95'], result['max'] = np.percentile(durations, 50), np.percentile(durations, 95), max(durations)
+
+    def run(self, parts, args):
+        cb = self.cb
+        if 'calculate_streak' in parts:
+            self.calculate_streak(args.streak_sample)
+        if 'record_all_streaks' in parts:
+            self.measure('record_all_streaks', lambda: cb.record_all_streaks(processes=args.processes))
+        if 'record_empty_post_streaks' in parts:
+            self.measure('record_empty_post_streaks', lambda: cb.record_empty_post_streaks(batch_size=args.empty_post_streaks))
+        if 'update_target_post' in parts:
+            self.update_target_post(args.new_posts, args.seed)
+        if 'update_all_flair' in parts:
+            self.measure('update_all_flair', lambda: cb.update_all_flair())
+        for leaderboard in LEADERBOARDS:
+            if leaderboard in parts:
+                self.measure(leaderboard, getattr(cb, leaderboard))
+        if 'export_database_to_JSON' in parts:
+            self.measure('export_database_to_JSON', cb.export_database_to_JSON)
+        return self.results
+
+LEADERBOARDS = ['update_count_leaderboard', 'update_whole_counts_leaderboard', 'update_identical_digits_leaderboard', 'update_palindrome_leaderboard',
+                'update_streak_leaderboard', 'update_hourly_leaderboards', 'update_top_posts_leaderboards']
+
+PARTS = ['calculate_streak', 'record_all_streaks', 'record_empty_post_streaks', 'update_target_post', 'update_all_flair'] + LEADERBOARDS + ['export_database_to_JSON']
+
+def previous_results(results_file, config):
+    # For every part: its result in the last run with the same configuration, and the commit of that run
+    previous = {}
+    if not os.path.exists(results_file):
+        return previous
+    with open(results_file) as f:
+        for line in f:
+            run = json.loads(line)
+            if run['config'] == config:
+                previous.update({name: (result, run['commit']) for name, result in run['results'].items()})
+    return previous
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot on a synthetic database, with a fake reddit.")
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--posts', type=int, default=500000)
+    parser.add_argument('--days', type=int, default=1000, help="the posts are spread over this many days, up to now")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--empty-post-streaks', type=int, default=5000, help="number of new posts without a streak yet")
+    parser.add_argument('--new-posts', type=int, default=100, help="number of new posts for update_target_post")
+    parser.add_argument('--streak-sample', type=int, default=200, help="number of users for calculate_streak")
+    parser.add_argument('--processes', type=int, default=1, help="processes for record_all_streaks")
+    parser.add_argument('--only', nargs='+', choices=PARTS, default=PARTS)
+    parser.add_argument('--data', default='benchmark_data', help="folder for the generated databases")
+    parser.add_argument('--results', default='benchmark_results.jsonl', help="the results of every run are added to this file")
+    parser.add_argument('--regenerate', action='store_true', help="generate the database again, even if it exists")
+    args = parser.parse_args()
+
+    config = {'users': args.users, 'posts': args.posts, 'days': args.days, 'seed': args.seed, 'empty_post_streaks': args.empty_post_streaks,
+              'new_posts': args.new_posts, 'streak_sample': args.streak_sample, 'processes': args.processes}
+    os.makedirs(args.data, exist_ok=True)
+    data = os.path.abspath(args.data)
+    generated_db = os.path.join(data, f"synthetic_{args.users}_{args.posts}_{args.days}_{args.seed}_{args.empty_post_streaks}")
+    if args.regenerate or not os.path.exists(generated_db+'.db'):
+        generate_database(generated_db, args.users, args.posts, args.days, args.seed, args.empty_post_streaks)
+
+    # Every run starts from the same database
+    db = os.path.join(data, 'benchmark')
+    shutil.copy(generated_db+'.db', db+'.db')
+    for suffix in ['-wal', '-shm']:
+        if os.path.exists(db+'.db'+suffix):
+            os.remove(db+'.db'+suffix)
+    reddit = FakeReddit()
+    cb = make_bot(db, reddit)
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        cb.setup_database()
+
+    # export_database_to_JSON writes to the working directory
+    results_file = os.path.abspath(args.results)
+    working_directory = os.getcwd()
+    os.chdir(data)
+    try:
+        results = Benchmark(cb, reddit).run(args.only, args)
+    finally:
+        cb.close_connection()
+        os.chdir(working_directory)
+
+    run = {'commit': current_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(), 'config': config, 'results': results}
+    previous = previous_results(results_file, config)
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(run) + "\n")
+
+    print(f"\n{'':<40}{'seconds':>12}{'per call':>12}{'SQL':>10}{'rows':>12}{'requests':>10}{'previous':>12}{'change':>9}  commit")
+    for name, result in results.items():
+        line = f"{name:<40}{result['seconds']:>12.3f}{result['seconds_per_call']:>12.4f}{result['sql_statements']:>10}{result['sql_rows']:>12}{result['reddit_requests']:>10}"
+        if name in previous:
+            previous_result, commit = previous[name]
+            change = (result['seconds']/previous_result['seconds'] - 1)*100 if previous_result['seconds'] else 0
+            line += f"{previous_result['seconds']:>12.3f}{change:>+8.0f}%  {commit}"
+        print(line)
+    print(f"Results added to {results_file}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
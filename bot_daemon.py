@@ -0,0 +1,134 @@
+# Runs all jobs of the bot in a single process:
+# - Checks every new post, and updates the post that tells the correct number (like total_update.py).
+# - Checks for posts that have been deleted within 10 minutes every 15 seconds, see DeletionWatcher (like updates_deleted_posts.py).
+# - Updates the streaks and flairs of users every hour, and all flairs once per day (like updates_flair.py).
+# - Updates the leaderboards on the wiki every hour/day (like update_leaderboards.py).
+# All jobs share one reddit session, one bot and its caches. The blocking work is done in worker threads:
+# one for moderating posts, and one for the heavy jobs, so those can never delay the moderation.
+
+from chickenbot import ChickenBot, DeletionWatcher
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+import os
+
+# Number of processes used to calculate the streaks of all users
+STREAK_PROCESSES = os.cpu_count() or 1
+
+# How often the jobs run, in seconds
+DELETED_POSTS_INTERVAL = 15
+STREAK_INTERVAL = 60*60
+FLAIR_INTERVAL = 24*60*60
+HOURLY_LEADERBOARDS_INTERVAL = 60*60
+POST_STATISTICS_INTERVAL = 60*60
+TOP_POSTS_INTERVAL = 24*60*60
+API_METRICS_INTERVAL = 60*60
+METRICS_FLUSH_INTERVAL = 60
+
+cb = None
+watcher = None
+
+moderation_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='moderation')
+heavy_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='heavy')
+
+async def run_in(worker, job):
+    return await asyncio.get_running_loop().run_in_executor(worker, job)
+
+async def every(interval, worker, job, run_immediately = True):
+    # Runs the job every interval seconds, counted from the start of the previous run.
+    if not run_immediately:
+        await asyncio.sleep(interval)
+    while True:
+        start = time.monotonic()
+        try:
+            await run_in(worker, job)
+        except Exception as e:
+            print(f"Error in {job.__name__}: {e}")
+        await asyncio.sleep(max(0, interval - (time.monotonic() - start)))
+
+def stream_submissions(loop, new_posts):
+    # PRAW's stream blocks while waiting for new posts, so it gets a thread of its own.
+    # Finding new posts is part of the moderation, so its requests go before all other jobs.
+    while True:
+        try:
+            with cb.api_priority('moderation'):
+                for submission in cb.subreddit.stream.submissions(skip_existing=True):
+                    loop.call_soon_threadsafe(new_posts.put_nowait, submission.id)
+        except Exception as e:
+            print(f"Error in submission stream: {e}")
+            time.sleep(30)
+
+async def moderate(new_posts):
+    while True:
+        await new_posts.get()
+        # update_target_post checks all new posts, so posts that came in meanwhile are handled by the same run
+        while not new_posts.empty():
+            new_posts.get_nowait()
+        while True:
+            try:
+                await run_in(moderation_worker, cb.update_target_post)
+                break
+            except Exception as e:
+                print(f"Error in execution: {e}")
+                await run_in(moderation_worker, cb.close_connection)
+                await asyncio.sleep(30)
+
+def check_for_deleted_posts():
+    watcher.step()
+
+def extra_streak_check():
+    # Only the flairs of users whose streak has changed are updated
+    cb.record_empty_post_streaks()
+    changed_users = cb.record_all_streaks(processes=STREAK_PROCESSES)
+    cb.update_all_flair(changed_users)
+
+def full_flair_check():
+    # Flairs can also be changed by users and moderators, or have been missed while the bot was down.
+    # That's why all flairs are checked once per day.
+    cb.record_empty_post_streaks()
+    cb.record_all_streaks(processes=STREAK_PROCESSES)
+    cb.update_all_flair()
+
+def update_hourly_leaderboards():
+    cb.update_hourly_leaderboards()
+
+def record_post_statistics():
+    # Only the posts that are due are refreshed, see ChickenBot.record_post_statistics
+    cb.record_post_statistics()
+
+def update_top_posts_leaderboards():
+    cb.update_top_posts_leaderboards()
+
+def flush_metrics():
+    # The metrics file is also written after the methods of the bot, but not while the bot is idle
+    cb.metrics.flush(force=True)
+
+def print_api_metrics():
+    # Shows how long each kind of job had to wait for the reddit API, see APIScheduler
+    print(f"API metrics: {cb.api_scheduler.metrics()}")
+
+async def main():
+    await run_in(moderation_worker, cb.update_target_post)
+
+    new_posts = asyncio.Queue()
+    threading.Thread(target=stream_submissions, args=(asyncio.get_running_loop(), new_posts), daemon=True).start()
+
+    await asyncio.gather(
+        moderate(new_posts),
+        every(DELETED_POSTS_INTERVAL, moderation_worker, check_for_deleted_posts),
+        every(FLAIR_INTERVAL, heavy_worker, full_flair_check),
+        every(STREAK_INTERVAL, heavy_worker, extra_streak_check, run_immediately=False),
+        every(HOURLY_LEADERBOARDS_INTERVAL, heavy_worker, update_hourly_leaderboards),
+        every(TOP_POSTS_INTERVAL, heavy_worker, update_top_posts_leaderboards),
+        every(POST_STATISTICS_INTERVAL, heavy_worker, record_post_statistics, run_immediately=False),
+        every(API_METRICS_INTERVAL, heavy_worker, print_api_metrics, run_immediately=False),
+        every(METRICS_FLUSH_INTERVAL, moderation_worker, flush_metrics, run_immediately=False)
+    )
+
+# The streaks are calculated in separate processes, which import this file again.
+# The guard makes sure those processes don't start a bot of their own.
+if __name__ == "__main__":
+    cb = ChickenBot()
+    watcher = DeletionWatcher(cb)
+    asyncio.run(main())
\ No newline at end of file
@@ -1,40 +1,714 @@
 import json
 import praw
+import prawcore
 import sqlite3
 import pandas as pd
 import math
 import pytz
 import time
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 import shutil
 import re
 import numpy as np
+from functools import lru_cache
+import zlib
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+from contextlib import contextmanager
+import os
+import sys
+import bisect
+
+@lru_cache(maxsize=None)
+def timezone_offset_table():
+    # For every timezone in pytz.common_timezones: the moments (in UTC seconds) at which
+    # the UTC offset changes, and the UTC offset (in seconds) from that moment onwards.
+    # This is read from pytz once, since it never changes while the bot is running.
+    table = []
+    for tz_name in pytz.common_timezones:
+        tz = pytz.timezone(tz_name)
+        if hasattr(tz, '_utc_transition_times'):
+            transitions = np.array([(moment - datetime(1970, 1, 1)).total_seconds() for moment in tz._utc_transition_times])
+            transitions[0] = -np.inf # pytz uses the first offset for everything before the first transition
+            offsets = np.array([info[0].total_seconds() for info in tz._transition_info])
+        else:
+            transitions = np.array([-np.inf])
+            offsets = np.array([tz.utcoffset(datetime(1970, 1, 1)).total_seconds()])
+        table.append((transitions, offsets))
+    return table
+
+@lru_cache(maxsize=None)
+def all_timezone_transitions():
+    # All moments at which any of the timezones changes its UTC offset.
+    return np.unique(np.concatenate([transitions[1:] for transitions, _ in timezone_offset_table()]))
+
+@lru_cache(maxsize=128)
+def timezone_offsets_in_segment(segment):
+    # Between two consecutive moments of all_timezone_transitions, no timezone changes its UTC offset.
+    start = -np.inf if segment == 0 else all_timezone_transitions()[segment - 1]
+    return np.array([offsets[np.searchsorted(transitions, start, side='right') - 1] for transitions, offsets in timezone_offset_table()])
+
+def timezone_offsets_at(timestamp):
+    # The UTC offset (in seconds) of every timezone at the given moment.
+    return timezone_offsets_in_segment(int(np.searchsorted(all_timezone_transitions(), timestamp, side='right')))
+
+def timezone_days(timestamp):
+    # The calendar day (days since 1970-01-01) of the timestamp, in every timezone.
+    return np.floor_divide(timestamp + timezone_offsets_at(timestamp), 86400).astype(np.int64)
+
+def posted_on_different_days(timestamps):
+    # Checks if there is a timezone in which all timestamps are on a different calendar day.
+    timestamps = np.sort(np.asarray(timestamps, dtype=float))
+    offsets = np.array([timezone_offsets_at(timestamp) for timestamp in timestamps])
+
+    if (offsets == offsets[0]).all():
+        # No timezone changes its UTC offset in between the posts.
+        # Two consecutive posts are then on different days, exactly if the first post is made
+        # within the last (time until the next post) seconds of its day. This gives an interval
+        # of UTC offsets for each pair of consecutive posts, and the offset must be in all of them.
+        gaps = np.diff(timestamps)[:, None]
+        time_of_day = (timestamps[:-1, None] + np.unique(offsets[0])) % 86400
+        different_days = (time_of_day >= 86400 - gaps) | (gaps >= 86400)
+        return bool(different_days.all(axis=0).any())
+
+    # Some timezone changes its UTC offset in between the posts, so look at the calendar days themselves.
+    days = np.floor_divide(timestamps[:, None] + np.unique(offsets, axis=1), 86400)
+    return bool((np.diff(days, axis=0) != 0).all(axis=0).any())
+
+def timezone_offset_classes(start, end):
+    # Most timezones share the same UTC offsets during a given period, so they
+    # put every post on the same calendar day and give the same streak.
+    # This groups the timezones by their offsets between start and end.
+    # It returns the moments at which any of the groups changes offset (breakpoints),
+    # per group the offset before the first breakpoint and after each breakpoint,
+    # and for every timezone the group it belongs to.
+    schedules = {}
+    zone_classes = []
+    for transitions, offsets in timezone_offset_table():
+        first = np.searchsorted(transitions, start, side='right') - 1
+        last = np.searchsorted(transitions, end, side='right')
+        schedule = [(-np.inf, offsets[first])]
+        for i in range(first + 1, last):
+            if offsets[i] != schedule[-1][1]:
+                schedule.append((transitions[i], offsets[i]))
+        zone_classes.append(schedules.setdefault(tuple(schedule), len(schedules)))
+
+    breakpoints = np.array(sorted({moment for schedule in schedules for moment, _ in schedule[1:]}))
+    segment_starts = np.concatenate(([-np.inf], breakpoints))
+    class_offsets = np.empty((len(schedules), len(segment_starts)))
+    for schedule, i in schedules.items():
+        moments = np.array([moment for moment, _ in schedule])
+        values = np.array([offset for _, offset in schedule])
+        class_offsets[i] = values[np.searchsorted(moments, segment_starts, side='right') - 1]
+    return breakpoints, class_offsets, np.array(zone_classes)
+
+def calendar_days(timestamps, breakpoints, class_offsets):
+    # The calendar day (days since 1970-01-01) of every timestamp, for every timezone group.
+    timestamps = np.asarray(timestamps, dtype=float)
+    segments = np.searchsorted(breakpoints, timestamps, side='right')
+    return np.floor_divide(timestamps + class_offsets[:, segments], 86400).astype(np.int64)
+
+NO_POST_DAY = -2**30
+
+def latest_chains(post_days):
+    # For every row of calendar days: the day of the most recent post, and the length of the
+    # chain of posts ending at that day, where every post is exactly one day before the next one.
+    n_rows, n_posts = post_days.shape
+    if n_posts == 0:
+        return np.full(n_rows, NO_POST_DAY, dtype=np.int64), np.zeros(n_rows, dtype=np.int64)
+    days = -np.sort(-post_days, axis=1) # Most recent post first
+    gaps = np.ones((n_rows, n_posts), dtype=bool) # The oldest post always ends the chain
+    gaps[:, :-1] = (days[:, :-1] - days[:, 1:]) != 1
+    return days[:, 0], gaps.argmax(axis=1) + 1
+
+def streaks_from_chains(last_days, chain_lengths, today, COAD_day = None, COAD_streak_number = 0):
+    # Calculates the streak for every timezone (group) at once, from the output of latest_chains.
+    # The chain only counts as a streak if the most recent post was today or yesterday.
+    recent = (last_days == today) | (last_days == today - 1)
+    streaks = np.where(recent, chain_lengths, 0)
+
+    if COAD_day is None:
+        return streaks, np.zeros(len(streaks), dtype=np.int64)
+
+    # People who moved from r/CountOnceADay,
+    # were allowed to continue the streak that was built up over there.
+    # The COAD streak counts from the COAD post onwards if it was made during the streak,
+    # or continues into the streak if it was made the day before the streak started.
+    COAD_streaks = np.where((COAD_day == today) | (COAD_day == today - 1), COAD_streak_number, 0)
+    first_days = last_days - chain_lengths + 1
+    COAD_streaks = np.where(recent & (COAD_day >= first_days) & (COAD_day < last_days), COAD_streak_number + last_days - COAD_day, COAD_streaks)
+    COAD_streaks = np.where(recent & (COAD_day == first_days - 1), COAD_streak_number + chain_lengths, COAD_streaks)
+    return streaks, COAD_streaks
+
+def streak_from_timestamps(post_timestamps, timestamp, last_COAD_timestamp = None, COAD_streak_number = 0):
+    # The longest streak (and COAD streak) over all timezones,
+    # counting only the posts made at or before timestamp.
+    post_timestamps = [post_timestamp for post_timestamp in post_timestamps if post_timestamp <= timestamp]
+    moments = post_timestamps + [timestamp]
+    if last_COAD_timestamp is not None:
+        moments.append(last_COAD_timestamp)
+    breakpoints, class_offsets, _ = timezone_offset_classes(min(moments), max(moments))
+
+    last_days, chain_lengths = latest_chains(calendar_days(post_timestamps, breakpoints, class_offsets))
+    today = calendar_days([timestamp], breakpoints, class_offsets)[:, 0]
+    COAD_day = None
+    if last_COAD_timestamp is not None:
+        COAD_day = calendar_days([last_COAD_timestamp], breakpoints, class_offsets)[:, 0]
+
+    streaks, COAD_streaks = streaks_from_chains(last_days, chain_lengths, today, COAD_day, COAD_streak_number)
+    return int(streaks.max()), int(COAD_streaks.max())
+
+def latest_chains_per_timezone(post_timestamps):
+    # latest_chains for every timezone, based on all posts of a user.
+    breakpoints, class_offsets, zone_classes = timezone_offset_classes(min(post_timestamps), max(post_timestamps))
+    last_days, chain_lengths = latest_chains(calendar_days(post_timestamps, breakpoints, class_offsets))
+    return last_days[zone_classes], chain_lengths[zone_classes]
+
+def encode_streak_state(last_days, chain_lengths):
+    return zlib.compress(np.array([last_days, chain_lengths], dtype=np.int32).tobytes())
+
+def decode_streak_state(state):
+    last_days, chain_lengths = np.frombuffer(zlib.decompress(state), dtype=np.int32).reshape(2, -1).astype(np.int64)
+    return last_days, chain_lengths
+
+def load_post_histories(conn, usernames = None, timestamp = None):
+    # Reads the post timestamps of the given users (or of all users) with as few queries as possible.
+    # Returns the timestamps per user, oldest first. Posts after timestamp are left out.
+    query = "SELECT username, timestamp FROM chicken_posts WHERE timestamp <= ?"
+    if timestamp is None:
+        timestamp = math.inf
+    histories = {}
+    if usernames is None:
+        chunks = [query + " ORDER BY timestamp"]
+        parameters = [(timestamp,)]
+    else:
+        usernames = list(usernames)
+        chunks, parameters = [], []
+        for i in range(0, len(usernames), 500): # SQLite limits the number of parameters per query
+            chunk = usernames[i:i+500]
+            chunks.append(query + f" AND username IN ({','.join('?'*len(chunk))}) ORDER BY timestamp")
+            parameters.append((timestamp, *chunk))
+    for chunk_query, chunk_parameters in zip(chunks, parameters):
+        for username, post_timestamp in conn.execute(chunk_query, chunk_parameters):
+            histories.setdefault(username, []).append(post_timestamp)
+    return histories
+
+def calculate_streaks(usernames, histories, timestamp, COAD_infos):
+    # Calculates the streaks of many users at once, from the output of load_post_histories
+    # and the COAD info per user. Returns the streaks per user, users for which it fails are left out.
+    streaks = {}
+    for username in usernames:
+        try:
+            streaks[username] = streak_from_timestamps(histories.get(username, []), timestamp, *COAD_infos.get(username, ()))
+        except Exception as e:
+            print(f"Error while calculating the streak of {username}: {e}")
+    return streaks
+
+_streak_worker_conn = None
+
+def init_streak_worker(db):
+    # Every worker process of record_all_streaks gets its own read-only database connection.
+    global _streak_worker_conn
+    _streak_worker_conn = sqlite3.connect(f"file:{db}.db?mode=ro", uri=True, timeout=30)
+
+def calculate_streaks_worker(job):
+    # Calculates the streaks of a chunk of users, with the COAD info given beforehand.
+    # Also returns the number of SQL statements and rows it took, so they can be counted in the MethodMetrics of the bot.
+    usernames, timestamp, COAD_infos = job
+    histories = load_post_histories(_streak_worker_conn, usernames, timestamp)
+    statements = math.ceil(len(usernames)/500)
+    rows = sum(len(history) for history in histories.values())
+    return calculate_streaks(usernames, histories, timestamp, COAD_infos), statements, rows
+
+def title_number_properties(title):
+    # The number in the title of a post, and the properties the leaderboards look for:
+    # (number, number of trailing zeroes, only identical digits, palindrome). None if the title is not a number.
+    if title is None or not title.isnumeric():
+        return None
+    try:
+        number = int(title)
+    except ValueError:
+        return None
+    if number >= 2**63:
+        return None
+    return number, len(title) - len(title.rstrip('0')), re.fullmatch(r'(\d)\1*', title) is not None, title == title[::-1]
+
+MIN_STATISTICS_INTERVAL = 60*60
+MAX_STATISTICS_INTERVAL = 7*24*60*60
+
+def next_statistics_update(post_timestamp, updated, old_statistics, new_statistics):
+    # The time the upvotes and comments of a post should be refreshed again.
+    # Young posts change a lot, so the interval grows with the age of the post. It is halved when the
+    # statistics still changed by at least 5% since the last refresh, and doubled when they didn't change at all.
+    interval = (updated - post_timestamp)/4
+    if None not in old_statistics:
+        change = sum(abs(new - old) for old, new in zip(old_statistics, new_statistics))/max(sum(old_statistics), 10)
+        if change >= 0.05:
+            interval /= 2
+        elif change == 0:
+            interval *= 2
+    return int(updated + min(max(interval, MIN_STATISTICS_INTERVAL), MAX_STATISTICS_INTERVAL))
+
+def posts_per_user(conn, chunk_size):
+    # The posts of every user (for export_database_to_JSON), in dicts of username: posts, with about chunk_size posts per dict.
+    # The users are in the order of their first post, their posts in the order they were added.
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.username, c.id, c.timestamp FROM chicken_posts c
+        JOIN (SELECT username, MIN(rowid) AS first_post FROM chicken_posts GROUP BY username) u ON u.username = c.username
+        ORDER BY u.first_post, c.rowid
+    """)
+    chunk = {}
+    size = 0
+    user_posts = None
+    previous_user = None
+    for rows in iter(lambda: cursor.fetchmany(chunk_size), []):
+        for username, post_id, timestamp in rows:
+            if user_posts is None or username != previous_user:
+                if size >= chunk_size:
+                    yield chunk
+                    chunk = {}
+                    size = 0
+                user_posts = chunk[username] = []
+                previous_user = username
+            user_posts.append({'member': f"t3_{post_id}", 'score': timestamp*1000})
+            size += 1
+    yield chunk
+
+def integers_or_nan(column):
+    # The values of a column as ints, and NaN for the missing values (whatever the type of the column has become because of them)
+    return [math.nan if pd.isna(value) else int(value) for value in column.tolist()]
+
+# Changes to the database on top of the tables created in setup_database.
+# The schema version of a database is stored in its user_version, every migration is applied once, in order.
+# Databases set up before the migrations existed might already have some of the columns, those are not added again (see migrate_database).
+SCHEMA_MIGRATIONS = [
+    # 1: Indexes for the queries that run the most
+    [
+        "CREATE INDEX IF NOT EXISTS chicken_posts_username_timestamp ON chicken_posts (username, timestamp)",
+        "CREATE INDEX IF NOT EXISTS chicken_posts_timestamp ON chicken_posts (timestamp)",
+        "CREATE INDEX IF NOT EXISTS chicken_posts_missing_streaks ON chicken_posts (id) WHERE current_streak IS NULL OR current_COAD_streak IS NULL",
+        "CREATE INDEX IF NOT EXISTS deleted_posts_username ON deleted_posts (username)"
+    ],
+    # 2: When the upvotes and comments of a post were refreshed, and when they should be refreshed next
+    [
+        "ALTER TABLE chicken_posts ADD COLUMN statistics_updated INTEGER DEFAULT NULL",
+        "ALTER TABLE chicken_posts ADD COLUMN statistics_next_update INTEGER DEFAULT NULL"
+    ],
+    # 3: The creation time of the COAD posts, see backfill_COAD_timestamps
+    [
+        "ALTER TABLE COAD_posts ADD COLUMN timestamp INTEGER"
+    ],
+    # 4: The number in the title of the posts, and its properties, see record_number_properties
+    [
+        "ALTER TABLE chicken_posts ADD COLUMN number INTEGER DEFAULT NULL",
+        "CREATE INDEX IF NOT EXISTS chicken_posts_number ON chicken_posts (number, timestamp)",
+        '''
+            CREATE TABLE IF NOT EXISTS number_properties (
+                id TEXT PRIMARY KEY,
+                trailing_zeroes INTEGER,
+                identical_digits BOOLEAN,
+                palindrome BOOLEAN,
+                first_claim BOOLEAN
+            )
+        ''',
+        "CREATE INDEX IF NOT EXISTS number_properties_trailing_zeroes ON number_properties (trailing_zeroes, first_claim)",
+        "CREATE INDEX IF NOT EXISTS number_properties_identical_digits ON number_properties (identical_digits, first_claim)",
+        "CREATE INDEX IF NOT EXISTS number_properties_palindrome ON number_properties (palindrome, first_claim)"
+    ],
+    # 5: The state the bot keeps between runs: the streak state per user (see get_streak_state), the current count,
+    # the decisions about recent posts (see get_post_decisions) and the hashes of the published wiki pages (see edit_wiki_page)
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS streak_states (
+                username TEXT PRIMARY KEY,
+                post_id TEXT,
+                timestamp INTEGER,
+                state BLOB,
+                previous_post_id TEXT,
+                previous_timestamp INTEGER,
+                previous_state BLOB
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS count_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                count INTEGER,
+                post_id TEXT,
+                timestamp INTEGER
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS post_decisions (
+                id TEXT PRIMARY KEY,
+                verdict TEXT,
+                count INTEGER,
+                timestamp INTEGER
+            )
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS wiki_pages (
+                page TEXT PRIMARY KEY,
+                hash TEXT,
+                timestamp INTEGER
+            )
+        '''
+    ]
+]
+
+# The queries the bot runs the most, with example parameters. check_query_plans makes sure none of them scans a whole table.
+HOT_QUERIES = [
+    ("SELECT timestamp FROM chicken_posts WHERE username = ? AND timestamp <= ?", ('username', 0)),
+    ("SELECT id, timestamp FROM chicken_posts WHERE username = ? ORDER BY timestamp", ('username',)),
+    ("SELECT id, timestamp, title FROM chicken_posts WHERE username = ? ORDER BY timestamp DESC LIMIT 2", ('username',)),
+    ("SELECT username, timestamp FROM chicken_posts WHERE timestamp <= ? AND username IN (?, ?)", (0, 'username', 'username')),
+    ("SELECT id, username FROM chicken_posts WHERE timestamp >= ?", (0,)),
+    ("SELECT id, username, timestamp FROM chicken_posts WHERE timestamp >= ? AND timestamp < ?", (0, 0)),
+    ("SELECT COUNT(*) FROM chicken_posts WHERE timestamp > ?", (0,)),
+    ("SELECT id FROM chicken_posts WHERE current_streak IS NULL OR current_COAD_streak IS NULL", ()),
+    ("SELECT id, title, timestamp FROM chicken_posts WHERE title != '' AND title NOT GLOB '*[^0-9]*' ORDER BY timestamp DESC LIMIT 1", ()),
+    ("SELECT * FROM deleted_posts WHERE username = ?", ('username',)),
+    ("SELECT id, verdict, count FROM post_decisions WHERE id IN (?, ?)", ('id', 'id'))
+]
+
+class ConnectionState(threading.local):
+    # The database connection of one thread, and how deep that thread is in the methods of the bot.
+    # Every thread keeps its connection (and the statements sqlite has prepared on it) for as long as it runs.
+    def __init__(self):
+        self.conn = None
+        self.cursor = None
+        self.call_depth = 0
+        self.keep_open = False
+        self.transaction_depth = 0
+
+_connection_state_lock = threading.Lock()
+
+# Reddit requests are handled in this order of priority, see APIScheduler
+API_PRIORITIES = ['moderation', 'deletions', 'flair', 'statistics', 'wiki']
+
+# The priority of the reddit requests made within these methods (unless an outer method already set one)
+API_PRIORITY_OF = {
+    'update_target_post': 'moderation',
+    'check_for_deleted_posts': 'deletions',
+    'check_posts_for_deletion': 'deletions',
+    'handle_moderator_removal': 'deletions',
+    'update_user_flair': 'flair',
+    'update_all_flair': 'flair',
+    'record_post_statistics': 'statistics',
+    'record_post_statistic': 'statistics',
+    'edit_wiki_page': 'wiki'
+}
+
+class APIScheduler:
+    # All reddit requests of a bot wait here for their turn (see ScheduledRequestor), so background work
+    # can't delay the moderation. It is a token bucket, of which the rate follows the rate limit headers of reddit:
+    # the requests that are left are spread over the time until the rate limit resets.
+    # A request only goes when no request of a higher priority is waiting, and when it leaves enough tokens
+    # for the requests of higher priority (reserves). Moderation never waits longer than for a single token.
+    def __init__(self, rate = 100/60, capacity = 10, reserves = None):
+        self.default_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.reset_at = None
+        self.reserves = reserves if reserves is not None else {'moderation': 0, 'deletions': 1, 'flair': 3, 'statistics': 3, 'wiki': 3}
+        self.condition = threading.Condition()
+        self.waiting = {priority: 0 for priority in API_PRIORITIES}
+        self.statistics = {priority: {'requests': 0, 'wait_time': 0.0, 'max_wait_time': 0.0} for priority in API_PRIORITIES}
+        self.local = threading.local()
+
+    def current_priority(self):
+        # Requests without a priority are handled last
+        return getattr(self.local, 'priority', None) or API_PRIORITIES[-1]
+
+    def set_priority(self, priority):
+        # Sets the priority of this thread, unless it already has one. Returns the previous one, for restore_priority.
+        previous = getattr(self.local, 'priority', None)
+        if previous is None and priority is not None:
+            self.local.priority = priority
+        return previous
+
+    def restore_priority(self, previous):
+        self.local.priority = previous
+
+    def refill(self):
+        now = time.monotonic()
+        if self.reset_at is not None and now >= self.reset_at:
+            # A new rate limit window has started
+            self.rate = self.default_rate
+            self.reset_at = None
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated)*self.rate)
+        self.updated = now
+
+    def acquire(self):
+        priority = self.current_priority()
+        higher_priorities = API_PRIORITIES[:API_PRIORITIES.index(priority)]
+        needed = 1 + self.reserves[priority]
+        start = time.monotonic()
+        with self.condition:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    self.refill()
+                    if self.tokens >= needed and not any(self.waiting[higher] for higher in higher_priorities):
+                        break
+                    if self.rate > 0:
+                        timeout = max(needed - self.tokens, 0)/self.rate
+                    else:
+                        timeout = self.reset_at - time.monotonic()
+                    self.condition.wait(min(max(timeout, 0.01), 1))
+                self.tokens -= 1
+            finally:
+                self.waiting[priority] -= 1
+                self.condition.notify_all()
+            wait_time = time.monotonic() - start
+            statistics = self.statistics[priority]
+            statistics['requests'] += 1
+            statistics['wait_time'] += wait_time
+            statistics['max_wait_time'] = max(statistics['max_wait_time'], wait_time)
+
+    def update(self, headers):
+        # Follows the rate limit headers of reddit's responses.
+        try:
+            remaining = float(headers['x-ratelimit-remaining'])
+            reset = float(headers['x-ratelimit-reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.condition:
+            self.refill()
+            self.rate = max(remaining, 0)/max(reset, 1)
+            self.reset_at = time.monotonic() + reset
+            self.tokens = min(self.tokens, remaining)
+            self.condition.notify_all()
+
+    def metrics(self):
+        # Per priority: the number of requests, the total and maximum time they waited, and how many are waiting now.
+        with self.condition:
+            metrics = {priority: dict(self.statistics[priority], queued=self.waiting[priority]) for priority in API_PRIORITIES}
+            metrics['tokens'] = self.tokens
+            metrics['rate'] = self.rate
+            return metrics
+
+class ScheduledRequestor(prawcore.Requestor):
+    # Makes every request of PRAW go through the APIScheduler, and counts it in the MethodMetrics.
+    def __init__(self, *args, scheduler = None, metrics = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler
+        self.metrics = metrics
+
+    def request(self, *args, **kwargs):
+        if self.metrics is not None:
+            self.metrics.count('api_calls')
+        self.scheduler.acquire()
+        response = super().request(*args, **kwargs)
+        self.scheduler.update(response.headers)
+        return response
+
+# Upper bounds (in seconds) of the buckets of the histograms of MethodMetrics
+METRIC_BUCKETS = [0.001, 0.01, 0.1, 1, 10, 60, 600]
+
+# Counted per method by MethodMetrics
+METRIC_COUNTERS = ['sql_statements', 'sql_rows', 'api_calls']
+
+class MethodMetrics:
+    # Measures every call of a method of the bot (see wrap_method): how often it's called, how long it takes,
+    # how many SQL statements it executes, how many rows it reads and how many reddit requests it makes.
+    # The numbers of a method include those of the methods it calls.
+    # Query them with snapshot() and slowest(), or read them from the file at path, which is rewritten
+    # (in the Prometheus text format) at most every flush_interval seconds.
+    def __init__(self, path = None, flush_interval = 60):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.local = threading.local()
+
+    def new_method(self):
+        method = {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'buckets': [0]*(len(METRIC_BUCKETS)+1)}
+        method.update({counter: 0 for counter in METRIC_COUNTERS})
+        return method
+
+    def calls(self):
+        # The method calls this thread is in, innermost last
+        if not hasattr(self.local, 'calls'):
+            self.local.calls = []
+        return self.local.calls
+
+    def start(self):
+        call = {counter: 0 for counter in METRIC_COUNTERS}
+        call['start'] = time.perf_counter()
+        self.calls().append(call)
+
+    def finish(self, name, failed = False):
+        calls = self.calls()
+        call = calls.pop()
+        seconds = time.perf_counter() - call['start']
+        if calls:
+            for counter in METRIC_COUNTERS:
+                calls[-1][counter] += call[counter]
+        with self.lock:
+            method = self.methods.setdefault(name, self.new_method())
+            method['calls'] += 1
+            method['errors'] += failed
+            method['seconds'] += seconds
+            method['max_seconds'] = max(method['max_seconds'], seconds)
+            method['buckets'][bisect.bisect_left(METRIC_BUCKETS, seconds)] += 1
+            for counter in METRIC_COUNTERS:
+                method[counter] += call[counter]
+
+    def count(self, counter, amount = 1):
+        # Adds to the counter of the method this thread is in. Outside of the methods of the bot, nothing is counted.
+        calls = self.calls()
+        if calls:
+            calls[-1][counter] += amount
+
+    def snapshot(self):
+        # All measurements so far: {method name: {'calls', 'errors', 'seconds', 'max_seconds', 'buckets', 'sql_statements', 'sql_rows', 'api_calls'}}
+        # 'buckets' has the number of calls per bucket of METRIC_BUCKETS (not cumulative), the last one for the slower calls.
+        with self.lock:
+            return {name: dict(method, buckets=list(method['buckets'])) for name, method in self.methods.items()}
+
+    def slowest(self, n = 10, key = 'seconds'):
+        # The n methods with the highest key (e.g. 'seconds', 'sql_rows' or 'api_calls'), as (method name, measurements)
+        return sorted(self.snapshot().items(), key=lambda item: item[1][key], reverse=True)[:n]
+
+    def reset(self):
+        with self.lock:
+            self.methods = {}
+
+    def prometheus(self):
+        lines = []
+        methods = sorted(self.snapshot().items())
+        def add(metric, metric_type, description, value_of):
+            lines.append(f"# HELP chickenbot_method_{metric} {description}")
+            lines.append(f"# TYPE chickenbot_method_{metric} {metric_type}")
+            for name, method in methods:
+                lines.append(f'chickenbot_method_{metric}{{method="{name}"}} {value_of(method)}')
+        add('calls_total', 'counter', 'Number of calls of the method.', lambda method: method['calls'])
+        add('errors_total', 'counter', 'Number of calls of the method that raised an exception.', lambda method: method['errors'])
+        add('sql_statements_total', 'counter', 'Number of SQL statements executed within the method.', lambda method: method['sql_statements'])
+        add('sql_rows_total', 'counter', 'Number of rows read from the database within the method.', lambda method: method['sql_rows'])
+        add('api_calls_total', 'counter', 'Number of reddit requests made within the method.', lambda method: method['api_calls'])
+        add('max_seconds', 'gauge', 'Duration of the slowest call of the method.', lambda method: method['max_seconds'])
+        lines.append("# HELP chickenbot_method_seconds Duration of the calls of the method.")
+        lines.append("# TYPE chickenbot_method_seconds histogram")
+        for name, method in methods:
+            cumulative = 0
+            for bound, calls in zip(METRIC_BUCKETS + ['+Inf'], method['buckets']):
+                cumulative += calls
+                lines.append(f'chickenbot_method_seconds_bucket{{method="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'chickenbot_method_seconds_sum{{method="{name}"}} {method["seconds"]}')
+            lines.append(f'chickenbot_method_seconds_count{{method="{name}"}} {method["calls"]}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self, force = False):
+        # Rewrites the metrics file, if flush_interval seconds have passed since the last time.
+        # The file is replaced at once, so a reader never sees half of it.
+        if self.path is None or (not force and time.monotonic() - self.last_flush < self.flush_interval):
+            return
+        self.last_flush = time.monotonic()
+        try:
+            temporary_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, 'w') as file:
+                file.write(self.prometheus())
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            print(f"Error writing metrics to {self.path}: {e}")
+
+class MeteredCursor(sqlite3.Cursor):
+    # Counts the rows that are read, see MethodMetrics
+    def count_rows(self, rows):
+        metrics = getattr(self.connection, 'metrics', None)
+        if metrics is not None:
+            metrics.count('sql_rows', rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.count_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        self.count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.count_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self.count_rows(1)
+        return row
+
+class MeteredConnection(sqlite3.Connection):
+    # Gives MeteredCursors (also to pandas), and counts the statements that are executed, see MethodMetrics
+    metrics = None
+
+    def cursor(self, factory = MeteredCursor):
+        return super().cursor(factory)
+
+    # The shortcuts of sqlite3.Connection make a plain cursor, whose rows wouldn't be counted
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        self.set_trace_callback(lambda statement: metrics.count('sql_statements'))
 
 def wrap_method(method):
     # (Almost) all methods are wrapped within this method.
-    # It makes sure the database connection stays open when the
-    # keyword 'keep_open' is set to True.
-    # If the keyword is omitted, the database connection will be closed,
-    # unless somewhere else up in the call stack, keep_open was set to True
+    # When the outermost method call of a thread is finished, everything
+    # it didn't commit is rolled back, unless the keyword 'keep_open' is set to True
+    # somewhere in the call stack. The connection itself stays open, to be reused by the next call.
 
     # This way, the database connection is automatically handled,
     # and doesn't need any attention.
+    # It also sets the priority of the reddit requests of the method, see API_PRIORITY_OF,
+    # and measures the method, see MethodMetrics.
     def wrapped(self, *args, **kwargs): 
-        previously_keep_open = self._keep_open
-        self._keep_open = kwargs.pop('keep_open', previously_keep_open) or previously_keep_open
+        state = self.connection_state()
+        previously_keep_open = state.keep_open
+        state.keep_open = kwargs.pop('keep_open', previously_keep_open) or previously_keep_open
 
-        self._call_stack.append(method.__name__)
+        scheduler = self.__dict__.get('api_scheduler')
+        if scheduler is not None:
+            previous_priority = scheduler.set_priority(API_PRIORITY_OF.get(method.__name__))
 
-        result = method(self, *args, **kwargs)
+        metrics = self.__dict__.get('metrics')
+        if metrics is not None:
+            metrics.start()
 
-        self._call_stack.pop()
-        if not self._call_stack:
-            self.handle_connection(self._keep_open)
-
-        if not previously_keep_open:
-            self._keep_open = False
-
-        return result
+        state.call_depth += 1
+        failed = True
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            state.call_depth -= 1
+            if state.call_depth == 0:
+                self.handle_connection(state.keep_open)
+
+            if not previously_keep_open:
+                state.keep_open = False
+
+            if scheduler is not None:
+                scheduler.restore_priority(previous_priority)
+
+            if metrics is not None:
+                metrics.finish(method.__name__, failed)
+                if state.call_depth == 0:
+                    metrics.flush()
     return wrapped
 
 class AutoPostCallMeta(type):
@@ -42,16 +716,99 @@ class AutoPostCallMeta(type):
     def __new__(cls, name, bases, class_dict):
         new_dict = {}
         for attr_name, attr_value in class_dict.items():
-            if callable(attr_value) and not attr_name.startswith("__") and attr_name not in ['handle_connection', 'connection_is_open', 'open_connection', 'close_connection', 'conn', 'cursor']:
+            if callable(attr_value) and not attr_name.startswith("__") and attr_name not in ['connection_state', 'handle_connection', 'connection_is_open', 'open_connection', 'close_connection', 'conn', 'cursor', 'transaction', 'api_priority']:
                 attr_value = wrap_method(attr_value)
             new_dict[attr_name] = attr_value
 
         return type.__new__(cls, name, bases, new_dict)
 
+class DeletionWatcher:
+    # Finds the posts that are deleted within 10 minutes of being posted, without checking all recent posts every few seconds:
+    # - Removals by moderators come in as events from the mod log (see ChickenBot.handle_moderator_removal).
+    # - Every post is checked once, margin seconds before its 10 minutes are over, to find the posts deleted by their author.
+    #   When a step is late (or a check fails), the posts it missed are checked during the next step, even if their 10 minutes are over by then.
+    # The events can come from any iterable of mod log entries that yields None when there are no new entries
+    # (like PRAW streams with pause_after=0), for example a scripted list of events for testing.
+    def __init__(self, bot, events = None, margin = 30):
+        self.bot = bot
+        self.margin = margin
+        self.use_mod_log = events is None
+        self.events = None if events is None else iter(events)
+        self.start = None # All posts created before this moment have been checked
+        self.checked = {} # Post id: creation time, of the checked posts created after start
+
+    def step(self, now = None):
+        # Handles the new events, and checks the posts of which the 10 minutes are almost over.
+        # Run this more often than every margin seconds. Returns the ids of the posts that have been checked.
+        now = time.time() if now is None else now
+        if self.events is None:
+            self.events = self.bot.subreddit.mod.stream.log(action='removelink', skip_existing=True, pause_after=0)
+        try:
+            with self.bot.api_priority('deletions'):
+                for action in self.events:
+                    if action is None:
+                        break
+                    self.bot.handle_moderator_removal(action.target_fullname[3:], action.created_utc)
+        except Exception as e:
+            print(f"Error in mod log stream: {e}")
+            if self.use_mod_log:
+                self.events = None
+
+        until = now - 600 + self.margin
+        if self.start is None:
+            self.start = now - 600
+        due = {post_id: post for post_id, post in self.bot.get_posts_due_for_deletion_check(self.start, until).items() if post_id not in self.checked}
+        checked = self.bot.check_posts_for_deletion({post_id: username for post_id, (username, _) in due.items()}) if due else set()
+        self.checked.update({post_id: due[post_id][1] for post_id in checked})
+
+        # The next step continues from the first post that could not be checked. After an hour, it stops trying.
+        failed = [timestamp for post_id, (_, timestamp) in due.items() if post_id not in checked and timestamp > now - 60*60]
+        self.start = min(failed, default=until)
+        self.checked = {post_id: timestamp for post_id, timestamp in self.checked.items() if timestamp >= self.start}
+        return checked
+
+class JSONWriter:
+    # Writes a JSON object one section (key and value) at a time, so the whole object never has to be in memory.
+    # The value of a section can also be written in chunks (lists or dicts), which together form one list or dict.
+    def __init__(self, file):
+        self.file = file
+        self.sections = 0
+        self.file.write('{')
+
+    def start_section(self, key):
+        if self.sections:
+            self.file.write(',\n')
+        self.sections += 1
+        self.file.write(f"{json.dumps(key)}: ")
+
+    def write(self, key, value):
+        self.start_section(key)
+        self.file.write(json.dumps(value))
+
+    def write_chunks(self, key, chunks, kind = list):
+        self.start_section(key)
+        self.file.write('[' if kind is list else '{')
+        first = True
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not first:
+                self.file.write(', ')
+            self.file.write(json.dumps(chunk)[1:-1])
+            first = False
+        self.file.write(']' if kind is list else '}')
+
+    def close(self):
+        self.file.write('}')
+
 class ChickenBot(metaclass=AutoPostCallMeta):
     def __init__(self):
         # Setup reddit bot connection
-        self.reddit = praw.Reddit('bot1')
+        # All requests to reddit go through the scheduler, see APIScheduler
+        self.api_scheduler = APIScheduler()
+        # Every method is measured, see MethodMetrics. The file is set once the database is known.
+        self.metrics = MethodMetrics()
+        self.reddit = praw.Reddit('bot1', requestor_class=ScheduledRequestor, requestor_kwargs={'scheduler': self.api_scheduler, 'metrics': self.metrics})
         self.reddit.validate_on_submit = True
 
         # Choose subreddit
@@ -72,41 +829,93 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         
         self.subreddit = self.reddit.subreddit(self.subredditname)
 
-    _connection_is_open = False
-    _keep_open = False
-    _call_stack = []
+        # Every script writes its own file, e.g. chicken_bot_bot_daemon.prom
+        self.metrics.path = f"{self.db}_{os.path.splitext(os.path.basename(sys.argv[0]))[0]}.prom"
+
+    _post_decisions_pruned = 0 # When the old decisions were last removed, see get_post_decisions
+    _target_post_count = None # The number currently shown in the target post
 
     def __del__(self):
         self.close_connection()
 
+    def connection_state(self):
+        # Every bot has its own connections, one per thread (see ConnectionState).
+        if '_connection_state' not in self.__dict__:
+            with _connection_state_lock:
+                if '_connection_state' not in self.__dict__:
+                    self._connection_state = ConnectionState()
+        return self._connection_state
+
     def connection_is_open(self):
-        return self._connection_is_open
+        return self.connection_state().conn is not None
     
     def open_connection(self):
-        if self._connection_is_open:
+        state = self.connection_state()
+        if state.conn is not None:
             return
-        self._connection_is_open = True
-        self._conn = sqlite3.connect(self.db+'.db')
-        self._conn.row_factory = sqlite3.Row
-        self._cursor = self._conn.cursor()
+        # The scripts share the database: wait for the others instead of failing when it is locked.
+        state.conn = sqlite3.connect(self.db+'.db', timeout=30, cached_statements=256, factory=MeteredConnection)
+        if self.__dict__.get('metrics') is not None:
+            state.conn.set_metrics(self.metrics)
+        state.conn.execute("PRAGMA synchronous = NORMAL")
+        state.conn.row_factory = sqlite3.Row
+        state.cursor = state.conn.cursor()
 
     def handle_connection(self, keep_open):
-        if not keep_open:
-            self.close_connection()
+        # Changes that haven't been committed are discarded, just like they would be when closing the connection.
+        state = self.connection_state()
+        if not keep_open and state.conn is not None and state.conn.in_transaction:
+            state.conn.rollback()
 
     def close_connection(self):
-        if self.connection_is_open():
-            self._conn.close()
-            self._connection_is_open = False
+        state = self.connection_state()
+        if state.conn is not None:
+            state.conn.close()
+            state.conn = None
+            state.cursor = None
+            state.transaction_depth = 0
     
     def conn(self):
         self.open_connection()
-        return self._conn
+        return self.connection_state().conn
 
     def cursor(self):
         self.open_connection()
-        return self._cursor
-        
+        return self.connection_state().cursor
+
+    @contextmanager
+    def api_priority(self, priority):
+        # The reddit requests in the with block get this priority (see API_PRIORITIES), unless one was set already.
+        scheduler = self.__dict__.get('api_scheduler')
+        if scheduler is None:
+            yield
+            return
+        previous_priority = scheduler.set_priority(priority)
+        try:
+            yield
+        finally:
+            scheduler.restore_priority(previous_priority)
+
+    @contextmanager
+    def transaction(self):
+        # Everything in the with block is committed at once, or rolled back if an exception occurs.
+        # A transaction within a transaction becomes part of the outer one.
+        # Methods that commit by themselves should not be called within the block.
+        state = self.connection_state()
+        if state.transaction_depth == 0 and not self.conn().in_transaction:
+            self.cursor().execute("BEGIN")
+        state.transaction_depth += 1
+        try:
+            yield self.cursor()
+        except BaseException:
+            state.transaction_depth -= 1
+            if state.transaction_depth == 0:
+                self.conn().rollback()
+            raise
+        state.transaction_depth -= 1
+        if state.transaction_depth == 0:
+            self.conn().commit()
+
     def setup_database(self):
         self.cursor().execute('''
             CREATE TABLE IF NOT EXISTS chicken_posts (
@@ -144,6 +953,95 @@ class ChickenBot(metaclass=AutoPostCallMeta):
             )
         ''')
         self.conn().commit()
+        self.migrate_database(keep_open=True)
+        self.backfill_number_properties(keep_open=True)
+        self.backfill_COAD_timestamps(keep_open=True)
+
+    def migrate_database(self):
+        # Applies the migrations in SCHEMA_MIGRATIONS that have not been applied to this database yet.
+        # WAL mode lets the leaderboards read while the moderation script writes. It is stored in the database file.
+        self.cursor().execute("PRAGMA journal_mode = WAL")
+        self.cursor().execute("PRAGMA user_version")
+        version = self.cursor().fetchone()[0]
+        for new_version, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version+1):
+            print(f"Migrating database to version {new_version}")
+            with self.transaction():
+                for statement in statements:
+                    column = re.match(r"ALTER TABLE (\w+) ADD COLUMN (\w+)", statement)
+                    if column is not None:
+                        self.cursor().execute(f"PRAGMA table_info({column[1]})")
+                        if column[2] in [row['name'] for row in self.cursor().fetchall()]:
+                            continue
+                    self.cursor().execute(statement)
+                self.cursor().execute(f"PRAGMA user_version = {new_version}")
+        self.check_query_plans(keep_open=True)
+
+    def check_query_plans(self):
+        # Returns (and prints) the queries in HOT_QUERIES that scan a whole table instead of using an index.
+        slow_queries = []
+        for query, params in HOT_QUERIES:
+            self.cursor().execute("EXPLAIN QUERY PLAN " + query, params)
+            plan = [row['detail'] for row in self.cursor().fetchall()]
+            if any(step.startswith('SCAN') and 'INDEX' not in step for step in plan):
+                print(f"Query does not use an index: {query}\n{plan}")
+                slow_queries.append(query)
+        return slow_queries
+
+    def backfill_COAD_timestamps(self):
+        # Looks up the creation time of COAD posts that were added before it was stored in the database.
+        self.cursor().execute("SELECT username, post_id FROM COAD_posts WHERE timestamp IS NULL")
+        COAD_posts = self.cursor().fetchall()
+        if COAD_posts:
+            print(f"Looking up the creation time of {len(COAD_posts)} COAD posts")
+        timestamps = [(self.reddit.submission(id=COAD_post['post_id']).created_utc, COAD_post['username']) for COAD_post in COAD_posts]
+        self.cursor().executemany("UPDATE COAD_posts SET timestamp = ? WHERE username = ?", timestamps)
+        self.conn().commit()
+
+    def record_number_properties(self, post_ids):
+        # Stores the number in the title of the posts, and its properties, so the leaderboards don't have to scan all titles.
+        # first_claim marks the first post (by creation time) of every number.
+        rows = []
+        for i in range(0, len(post_ids), 500):
+            chunk = post_ids[i:i+500]
+            self.cursor().execute(f"SELECT id, title FROM chicken_posts WHERE id IN ({','.join('?'*len(chunk))})", chunk)
+            rows += self.cursor().fetchall()
+
+        numbers = []
+        properties = []
+        for row in rows:
+            number_properties = title_number_properties(row['title'])
+            if number_properties is None:
+                continue
+            number, trailing_zeroes, identical_digits, palindrome = number_properties
+            numbers.append((number, row['id']))
+            properties.append((row['id'], trailing_zeroes, identical_digits, palindrome))
+        self.cursor().executemany("UPDATE chicken_posts SET number = ? WHERE id = ?", numbers)
+        self.cursor().executemany("INSERT OR REPLACE INTO number_properties (id, trailing_zeroes, identical_digits, palindrome, first_claim) VALUES (?, ?, ?, ?, 0)", properties)
+        self.cursor().executemany('''
+            UPDATE number_properties SET first_claim = (id = (SELECT id FROM chicken_posts WHERE number = ? ORDER BY timestamp, rowid LIMIT 1))
+            WHERE id IN (SELECT id FROM chicken_posts WHERE number = ?)
+        ''', [(number, number) for number in set(number for number, _ in numbers)])
+        self.conn().commit()
+
+    def remove_number_properties(self, post_id):
+        # Call this before the post is deleted from chicken_posts.
+        # If the post was the first post of its number, the next post with that number takes over.
+        self.cursor().execute("SELECT c.number, p.first_claim FROM chicken_posts c JOIN number_properties p ON p.id = c.id WHERE c.id = ?", (post_id,))
+        row = self.cursor().fetchone()
+        self.cursor().execute("DELETE FROM number_properties WHERE id = ?", (post_id,))
+        if row is not None and row['first_claim']:
+            self.cursor().execute('''
+                UPDATE number_properties SET first_claim = 1
+                WHERE id = (SELECT id FROM chicken_posts WHERE number = ? AND id != ? ORDER BY timestamp, rowid LIMIT 1)
+            ''', (row['number'], post_id))
+
+    def backfill_number_properties(self):
+        # Records the number properties of posts that were added before they were stored in the database.
+        self.cursor().execute("SELECT id FROM chicken_posts WHERE id NOT IN (SELECT id FROM number_properties)")
+        post_ids = [row['id'] for row in self.cursor().fetchall()]
+        if post_ids:
+            print(f"Recording the number properties of {len(post_ids)} posts")
+            self.record_number_properties(post_ids, keep_open=True)
 
     def backup_database(self):
         shutil.copy2(self.db+'.db', f"{self.db} backup {datetime.now().strftime('%Y-%m-%d %H.%M.%S')}.db")
@@ -154,12 +1052,19 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         # Many users will upload posts with the wrong count.
         # If the bot is activated, it will remove all these posts.
         # To avoid this (and register all recent posts as valid), run this function.
+        inserted_posts = []
         for post in self.subreddit.new(limit=1000):  # Fetches the newest posts
             self.cursor().execute('''
                 INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title)
                 VALUES (?, ?, ?, 1, ?)
             ''', (post.id, self.get_author(post), post.created_utc, post.title))
+            if self.cursor().rowcount == 1:
+                inserted_posts.append(post.id)
+                # The streak state is rebuilt the next time it is needed
+                self.cursor().execute("DELETE FROM streak_states WHERE username = ?", (self.get_author(post),))
+        self.refresh_count_state(keep_open=True)
         self.conn().commit()
+        self.record_number_properties(inserted_posts, keep_open=True)
 
     def get_all_posts(self, username):
         posts = pd.read_sql("SELECT * FROM chicken_posts WHERE username = ?", self.conn(), params=(username,))
@@ -179,74 +1084,136 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         if timestamp is None:
             timestamp = time.time()
 
-        df = pd.read_sql("SELECT timestamp FROM chicken_posts WHERE username = ? AND timestamp <= ?", self.conn(), params=(username,timestamp))
-        self.cursor().execute("SELECT * FROM COAD_posts WHERE username = ?", (username,))
-        
+        self.cursor().execute("SELECT timestamp FROM chicken_posts WHERE username = ? AND timestamp <= ?", (username, timestamp))
+        post_timestamps = [row['timestamp'] for row in self.cursor().fetchall()]
+
+        COAD_info = self.get_COAD_info(username, keep_open=True)
+        if COAD_info:
+            return streak_from_timestamps(post_timestamps, timestamp, *COAD_info)
+        return streak_from_timestamps(post_timestamps, timestamp)
+
+    def get_post_histories(self, usernames = None, timestamp = None):
+        # The post timestamps of the given users (or of all users), oldest first.
+        return load_post_histories(self.conn(), usernames, timestamp)
+
+    def get_all_COAD_info(self, usernames = None):
+        # get_COAD_info for all users (or the given users) that have a COAD streak.
+        self.cursor().execute("SELECT username FROM COAD_posts")
+        COAD_users = [row['username'] for row in self.cursor().fetchall()]
+        if usernames is not None:
+            COAD_users = [user for user in COAD_users if user in usernames]
+        return {user: self.get_COAD_info(user, keep_open=True) for user in COAD_users}
+
+    def get_COAD_info(self, username):
         # People who moved from r/CountOnceADay,
         # were allowed to continue the streak that was built up over there.
         # The COAD_streak is the streak that includes that previous streak.
+        # Returns the timestamp of the last COAD post and the COAD streak, or None.
+        self.cursor().execute("SELECT * FROM COAD_posts WHERE username = ?", (username,))
         COAD_streak_info = self.cursor().fetchone()
+        if not COAD_streak_info:
+            return None
+        if COAD_streak_info['timestamp'] is None:
+            # Run setup_database to look these up all at once
+            self.backfill_COAD_timestamps(keep_open=True)
+            return self.get_COAD_info(username, keep_open=True)
+        return COAD_streak_info['timestamp'], COAD_streak_info['streak']
+
+    # The streak state of a user stores, for every timezone, the day of the most recent post
+    # and the number of consecutive days (one post per day) leading up to it.
+    # This way, a new post only needs the state instead of all previous posts of the user.
+    # The previous state is kept as well, so that the newest post can be removed again.
+
+    def rebuild_streak_state(self, username):
+        # Recalculates the streak state from all posts of the user.
+        # Only needed after manual changes to the database.
+        # Like the other changes to the streak state, it becomes part of the transaction it is called in (if any).
+        self.cursor().execute("SELECT id, timestamp FROM chicken_posts WHERE username = ? ORDER BY timestamp", (username,))
+        posts = self.cursor().fetchall()
+        with self.transaction():
+            self.cursor().execute("DELETE FROM streak_states WHERE username = ?", (username,))
+            if posts:
+                last_days, chain_lengths = latest_chains_per_timezone([post['timestamp'] for post in posts])
+                self.cursor().execute("INSERT INTO streak_states (username, post_id, timestamp, state) VALUES (?, ?, ?, ?)",
+                                      (username, posts[-1]['id'], posts[-1]['timestamp'], encode_streak_state(last_days, chain_lengths)))
+
+    def get_streak_state(self, username):
+        # Returns the streak state of the user (rebuilding it if needed), or None if the user has no posts.
+        query = "SELECT post_id, timestamp, state FROM streak_states WHERE username = ?"
+        self.cursor().execute(query, (username,))
+        state = self.cursor().fetchone()
+        # The list of timezones might change after updating pytz
+        if state is None or len(decode_streak_state(state['state'])[0]) != len(timezone_offset_table()):
+            self.rebuild_streak_state(username, keep_open=True)
+            self.cursor().execute(query, (username,))
+            state = self.cursor().fetchone()
+            if state is None:
+                return None
+        return state['post_id'], state['timestamp'], *decode_streak_state(state['state'])
+
+    def add_to_streak_state(self, username, post_id, timestamp):
+        # Updates the streak state with a new post of the user.
+        # Call this in the same transaction as inserting the post, so the streak state never misses it.
+        self.cursor().execute("SELECT timestamp, state FROM streak_states WHERE username = ?", (username,))
+        state = self.cursor().fetchone()
+        if state is None or timestamp < state['timestamp']:
+            self.rebuild_streak_state(username, keep_open=True)
+            return
 
-        if COAD_streak_info:
-            last_COAD_timestamp = self.reddit.submission(id=COAD_streak_info['post_id']).created_utc
-            COAD_streak_number = COAD_streak_info['streak']
-            has_COAD_streak = True
-        else:
-            has_COAD_streak = False
+        last_days, chain_lengths = decode_streak_state(state['state'])
+        new_days = timezone_days(timestamp)
+        if len(last_days) != len(new_days) or (new_days < last_days).any():
+            # A change of UTC offset can put a newer post on an earlier day.
+            self.rebuild_streak_state(username, keep_open=True)
+            return
 
-        # Ensure timestamp is datetime
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit='s', utc=True)
-        if has_COAD_streak:
-            last_COAD_datetime = datetime.fromtimestamp(last_COAD_timestamp, tz=timezone.utc)
+        chain_lengths = np.where(new_days == last_days + 1, chain_lengths + 1, 1)
+        with self.transaction():
+            self.cursor().execute('''
+                UPDATE streak_states SET
+                previous_post_id = post_id, previous_timestamp = timestamp, previous_state = state,
+                post_id = ?, timestamp = ?, state = ?
+                WHERE username = ?
+            ''', (post_id, timestamp, encode_streak_state(new_days, chain_lengths), username))
+
+    def remove_from_streak_state(self, username, post_id):
+        # Updates the streak state after a post of the user has been removed from the database.
+        self.cursor().execute("SELECT post_id, previous_state FROM streak_states WHERE username = ?", (username,))
+        state = self.cursor().fetchone()
+        if state is None or state['post_id'] != post_id or state['previous_state'] is None:
+            self.rebuild_streak_state(username, keep_open=True)
+            return
 
-        max_streak = 0 # Track the longest streak across all timezones
-        max_COAD_streak = 0 # Track the longest COAD streak across all timezones
-        
-        for tz_name in pytz.common_timezones:
-            # TODO: Stop loop if it is clear that it won't get better. For example, the last post was more than 48 hours ago.
-            tz = pytz.timezone(tz_name)
-    
-            # Convert timestamp to the specific timezone
-            df["local_time"] = df["timestamp"].dt.tz_convert(tz)
-            df["post_date"] = df["local_time"].dt.date  # Extract date part
-            df = df.sort_values("post_date", ascending = False)
+        with self.transaction():
+            self.cursor().execute('''
+                UPDATE streak_states SET
+                post_id = previous_post_id, timestamp = previous_timestamp, state = previous_state,
+                previous_post_id = NULL, previous_timestamp = NULL, previous_state = NULL
+                WHERE username = ?
+            ''', (username,))
+
+    def calculate_streak_from_state(self, username, timestamp = None):
+        # Gives the same result as calculate_streak, but uses the streak state instead of all posts of the user.
+        if timestamp is None:
+            timestamp = time.time()
 
-            if has_COAD_streak:
-                last_COAD_date = last_COAD_datetime.astimezone(tz).date()
-    
-            # Find the longest current streak
-            streak = 0
-            COAD_streak = 0
-            last_date = None
-
-            today_datetime = datetime.fromtimestamp(timestamp, tz=tz)
-            today = today_datetime.date()
-            yesterday = (today_datetime - timedelta(days=1)).date()
-
-            if has_COAD_streak and (last_COAD_date == today or last_COAD_date == yesterday):
-                COAD_streak = COAD_streak_number
-
-            for date in df["post_date"]:
-                if (date == today or date == yesterday) and last_date is None: # This was the first post, and it was today or yesterday
-                    streak = 1
-                    last_date = date
-                elif last_date is not None: # This was not the first post
-                    if date == last_date - timedelta(days=1): # The previous post was yesterday
-                        if has_COAD_streak and date == last_COAD_date:
-                            COAD_streak = COAD_streak_number + streak
-                        streak += 1
-                        last_date = date
-                    else:
-                        break
-                else: # PRevious post was earlier than today or yesterday
-                    streak = 0
-                    break
-            if has_COAD_streak and last_date is not None and last_COAD_date == last_date - timedelta(days=1):
-                COAD_streak = COAD_streak_number + streak
-            max_streak = max(max_streak, streak)
-            if has_COAD_streak:
-                max_COAD_streak = max(max_COAD_streak, COAD_streak)
-        return max_streak, max_COAD_streak
+        state = self.get_streak_state(username, keep_open=True)
+        if state is None:
+            last_days = np.full(len(timezone_offset_table()), NO_POST_DAY)
+            chain_lengths = np.zeros(len(timezone_offset_table()), dtype=np.int64)
+        else:
+            _, last_timestamp, last_days, chain_lengths = state
+            if timestamp < last_timestamp:
+                # The state also contains posts made after timestamp
+                return self.calculate_streak(username, timestamp=timestamp, keep_open=True)
+
+        COAD_info = self.get_COAD_info(username, keep_open=True)
+        if COAD_info:
+            last_COAD_timestamp, COAD_streak_number = COAD_info
+            streaks, COAD_streaks = streaks_from_chains(last_days, chain_lengths, timezone_days(timestamp), timezone_days(last_COAD_timestamp), COAD_streak_number)
+        else:
+            streaks, COAD_streaks = streaks_from_chains(last_days, chain_lengths, timezone_days(timestamp))
+        return int(streaks.max()), int(COAD_streaks.max())
 
     def record_streak(self, username):
         self.cursor().execute("""
@@ -256,40 +1223,73 @@ class ChickenBot(metaclass=AutoPostCallMeta):
             timestamp = CURRENT_TIMESTAMP,
             streak = excluded.streak,
             COAD_streak = excluded.COAD_streak
-        """, (username, *self.calculate_streak(username, keep_open=True)))
+        """, (username, *self.calculate_streak_from_state(username, keep_open=True)))
         self.conn().commit()
 
-    def record_all_streaks(self):
+    def record_all_streaks(self, processes = 1):
+        # Recalculates the streaks of all users, and records them all at once.
+        # With processes > 1, the streaks are calculated by a pool of worker processes.
+        # Returns the users whose streak has changed, so only their flair needs to be updated.
         print("Calculating user streaks")
         
         users = self.get_all_users(keep_open=True)
-        streaks = {}
+        timestamp = time.time()
+        COAD_infos = self.get_all_COAD_info(keep_open=True)
 
-        for user_no, user in enumerate(users):
-            if (user_no+1) % 20 == 0:
-                print(f"user {user_no+1} out of {len(users)}")
-            streaks[user] = {}
-            while True:
-                try:
-                    streaks[user]['normal'], streaks[user]['COAD'] = self.calculate_streak(user, keep_open = False)
-                except:
-                    print("Error, try again in 500 seconds")
-                    self.close_connection()
-                    time.sleep(500)
-                break
-    
-        for user, streak in streaks.items():
-            self.cursor().execute("""
-                INSERT INTO user_streaks (timestamp, username, streak, COAD_streak)
-                VALUES (CURRENT_TIMESTAMP, ?, ?, ?)
-                ON CONFLICT(username) DO UPDATE SET
-                timestamp = CURRENT_TIMESTAMP,
-                streak = excluded.streak,
-                COAD_streak = excluded.COAD_streak
-            """, (user, streak['normal'], streak['COAD']))
-        
+        streaks = {}
+        if processes > 1:
+            streaks = self.calculate_streaks_in_pool(users, timestamp, COAD_infos, processes, keep_open=True)
+
+        # Users are calculated here if there is no pool, or if it failed for them
+        remaining_users = [user for user in users if user not in streaks]
+        if remaining_users:
+            histories = self.get_post_histories(remaining_users, timestamp, keep_open=True)
+            streaks.update(calculate_streaks(remaining_users, histories, timestamp, COAD_infos))
+        for user in users:
+            if user not in streaks:
+                print(f"Could not calculate the streak of {user}, the previous streak is kept")
+
+        self.cursor().execute("SELECT username, streak, COAD_streak FROM user_streaks")
+        previous_streaks = {row['username']: (row['streak'], row['COAD_streak']) for row in self.cursor().fetchall()}
+        changed_users = {user for user, streak in streaks.items() if previous_streaks.get(user) != streak}
+
+        self.cursor().executemany("""
+            INSERT INTO user_streaks (timestamp, username, streak, COAD_streak)
+            VALUES (CURRENT_TIMESTAMP, ?, ?, ?)
+            ON CONFLICT(username) DO UPDATE SET
+            timestamp = CURRENT_TIMESTAMP,
+            streak = excluded.streak,
+            COAD_streak = excluded.COAD_streak
+        """, [(user, streak, COAD_streak) for user, (streak, COAD_streak) in streaks.items()])
         self.conn().commit()
-        print("Finished recording user streaks")
+        print(f"Finished recording user streaks, {len(changed_users)} streaks have changed")
+        return changed_users
+
+    def calculate_streaks_in_pool(self, users, timestamp, COAD_infos, processes):
+        # The workers only get a read-only database connection, and no reddit connection.
+        # That's why the COAD info is looked up beforehand.
+        # Returns the streaks per user, users for which it failed are left out.
+        # The workers are started fresh (spawn), instead of as a copy of this process (fork):
+        # in bot_daemon.py other threads might hold a lock (of sqlite, a connection to reddit or print) at that moment,
+        # which would never be released in the copy.
+        print(f"Calculating streaks with {processes} processes")
+        streaks = {}
+        try:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'), initializer=init_streak_worker, initargs=(self.db,)) as pool:
+                jobs = [(users[i:i+200], timestamp, COAD_infos) for i in range(0, len(users), 200)]
+                for chunk_streaks, statements, rows in pool.map(calculate_streaks_worker, jobs):
+                    streaks.update(chunk_streaks)
+                    if self.__dict__.get('metrics') is not None:
+                        self.metrics.count('sql_statements', statements)
+                        self.metrics.count('sql_rows', rows)
+                    print(f"user {len(streaks)} out of {len(users)}")
+        except Exception as e:
+            print(f"Error in the process pool: {e}")
+
+        failed_users = len(users) - len(streaks)
+        if failed_users:
+            print(f"The streaks of {failed_users} users could not be calculated in the process pool")
+        return streaks
 
     def record_post_streak(self, post_id, replace = True):
         # Records the streak at the moment the post was made
@@ -297,23 +1297,47 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         username, timestamp, streak, COAD_streak = self.cursor().fetchone()
         if not replace and streak is not None and COAD_streak is not None:
             return
-        streak, COAD_streak = self.calculate_streak(username, timestamp=timestamp, keep_open=True)
+        self.cursor().execute("SELECT post_id FROM streak_states WHERE username = ?", (username,))
+        state = self.cursor().fetchone()
+        if state is not None and state['post_id'] == post_id:
+            # This is the most recent post of the user, so the streak state can be used
+            streak, COAD_streak = self.calculate_streak_from_state(username, timestamp=timestamp, keep_open=True)
+        else:
+            streak, COAD_streak = self.calculate_streak(username, timestamp=timestamp, keep_open=True)
         self.cursor().execute("UPDATE chicken_posts SET current_streak = ?, current_COAD_streak = ? WHERE id = ?", (streak, COAD_streak, post_id))
         self.conn().commit()
 
+    def record_post_streaks(self, post_ids):
+        # Records the streak at the moment the post was made, for many posts at once.
+        # The posts and COAD info of all users involved are read only once.
+        posts = []
+        for i in range(0, len(post_ids), 500): # SQLite limits the number of parameters per query
+            chunk = post_ids[i:i+500]
+            self.cursor().execute(f"SELECT id, username, timestamp FROM chicken_posts WHERE id IN ({','.join('?'*len(chunk))})", chunk)
+            posts += self.cursor().fetchall()
+
+        users = {post['username'] for post in posts}
+        histories = self.get_post_histories(users, keep_open=True)
+        COAD_infos = self.get_all_COAD_info(users, keep_open=True)
+
+        post_streaks = []
+        for i, post in enumerate(posts):
+            if (i+1) % 100 == 0:
+                print(f"Recording post streaks: post {i+1} out of {len(posts)}")
+            try:
+                streak, COAD_streak = streak_from_timestamps(histories.get(post['username'], []), post['timestamp'], *COAD_infos.get(post['username'], ()))
+                post_streaks.append((streak, COAD_streak, post['id']))
+            except Exception as e:
+                print(f"Error while recording the streak of post {post['id']}: {e}")
+
+        self.cursor().executemany("UPDATE chicken_posts SET current_streak = ?, current_COAD_streak = ? WHERE id = ?", post_streaks)
+        self.conn().commit()
+
     def record_post_streaks_user(self, username):
-        posts = pd.read_sql("SELECT id FROM chicken_posts WHERE username = ?", self.conn(), params=(username,))
-        for i, post_id in enumerate(posts['id']):
-            if (i+1) % 20 == 0:
-                print("Recording post streaks for user", username, "post", i+1, "out of", len(posts))
-            while True:
-                try:
-                    self.record_post_streak(post_id, keep_open=True)
-                    break
-                except Exception as e:
-                    print(f"Error at post {i+1}, try again in 30 seconds")
-                    print(f"Exception: {e}")
-                    time.sleep(30)
+        self.cursor().execute("SELECT id FROM chicken_posts WHERE username = ?", (username,))
+        post_ids = [row['id'] for row in self.cursor().fetchall()]
+        print(f"Recording post streaks for user {username}: {len(post_ids)} posts")
+        self.record_post_streaks(post_ids, keep_open=True)
         self.record_streak(username)
 
     def record_empty_post_streaks(self, batch_size = 500):
@@ -321,20 +1345,12 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         # only a small part of empty post streaks is recorded, to make sure
         # it isn't too much work for the VM. This function should be called
         # multiple times, until all empty post_streaks are recorded.
-        posts = pd.read_sql("SELECT id FROM chicken_posts WHERE current_streak IS NULL OR current_COAD_streak IS NULL", self.conn())
-        print(f"Recording empty post streaks: {min(batch_size,len(posts))} posts will be handled during this function call.")
-        for i, post_id in enumerate(posts['id']):
-            if i == batch_size:
-                print(f"Batch size reached, {len(posts)-i} left to do!")
-                break
-            print("Recording empty post streaks", i+1, "out of", len(posts))
-            for j in range(0,10):
-                try:
-                    self.record_post_streak(post_id, keep_open=True)
-                except:
-                    print("Error, try again in 500 seconds")
-                    self.close_connection()
-                    time.sleep(500)
+        self.cursor().execute("SELECT id FROM chicken_posts WHERE current_streak IS NULL OR current_COAD_streak IS NULL")
+        post_ids = [row['id'] for row in self.cursor().fetchall()]
+        print(f"Recording empty post streaks: {min(batch_size,len(post_ids))} posts will be handled during this function call.")
+        if len(post_ids) > batch_size:
+            print(f"Batch size reached, {len(post_ids)-batch_size} left to do!")
+        self.record_post_streaks(post_ids[:batch_size], keep_open=True)
         print("Finished recording empty post streaks")
 
     def record_post_statistic(self, post_id):
@@ -348,26 +1364,69 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         post.comments.replace_more(limit=None)
         comments = len(post.comments.list())
 
-        self.cursor().execute("UPDATE chicken_posts SET comments = ?, upvotes = ? WHERE id = ?", (comments, upvotes, post_id))
+        self.cursor().execute("UPDATE chicken_posts SET comments = ?, upvotes = ?, statistics_updated = ? WHERE id = ?", (comments, upvotes, int(time.time()), post_id))
         self.conn().commit()
 
-    def record_post_statistics(self, n_days_history = 21):
-        # Record upvote and comment count for all posts in the past n_days_history days.
-        # Used for post leaderboard.
-        posts = pd.read_sql("SELECT id FROM chicken_posts WHERE timestamp >= ? OR comments IS NULL OR upvotes IS NULL", self.conn(), params=(time.time()-n_days_history*24*60*60,))
-        print(f'Recording post statistics for the past {n_days_history} days: {len(posts)} posts')
-        for i, row in posts.iterrows():
-            if (i+1) % 100 == 0:
-                print(f"Post {i+1} out of {len(posts)}")
-            while True:
+    def record_post_statistics(self, n_days_history = 21, exact_comments = False, request_budget = 20):
+        # Record upvote and comment count for the posts in the past n_days_history days that are due for a refresh
+        # (see next_statistics_update), and for posts without statistics. Used for post leaderboard.
+        # The posts are fetched 100 per request, at most request_budget requests are made per run.
+        # Posts without statistics go first, then the posts that are overdue the longest.
+        # The comment count is the count reddit gives,
+        # with exact_comments the comments are counted by expanding all comments of each post (slow).
+        # request_budget doesn't cover exact_comments: that takes (on top of the budget) a request for the comments of every post,
+        # and one for every 'load more comments' in them, however many that are.
+        now = int(time.time())
+        self.cursor().execute("""
+            SELECT id, timestamp, upvotes, comments FROM chicken_posts
+            WHERE (comments IS NULL OR upvotes IS NULL OR timestamp >= ?)
+            AND (statistics_next_update IS NULL OR statistics_next_update <= ?)
+            ORDER BY (comments IS NULL OR upvotes IS NULL) DESC, statistics_next_update ASC, timestamp DESC
+            LIMIT ?
+        """, (now-n_days_history*24*60*60, now, request_budget*100))
+        posts = {row['id']: row for row in self.cursor().fetchall()}
+        post_ids = list(posts)
+        print(f'Recording post statistics for the past {n_days_history} days: {len(post_ids)} posts due')
+
+        statistics = []
+        missing = []
+        for i in range(0, len(post_ids), 100):
+            print(f"Post {i+1} out of {len(post_ids)}")
+            for attempt in range(3):
                 try:
-                    self.record_post_statistic(row['id'],keep_open=True)
+                    batch = []
+                    for post in self.reddit.info(fullnames=[f"t3_{post_id}" for post_id in post_ids[i:i+100]]):
+                        comments = post.num_comments
+                        if exact_comments:
+                            post.comments.replace_more(limit=None)
+                            comments = len(post.comments.list())
+                        updated = int(time.time())
+                        row = posts[post.id]
+                        next_update = next_statistics_update(row['timestamp'], updated, (row['upvotes'], row['comments']), (post.score, comments))
+                        batch.append((comments, post.score, updated, next_update, post.id))
+                    statistics += batch
+                    missing += set(post_ids[i:i+100]) - {post[-1] for post in batch}
                     break
                 except Exception as e:
-                    print(e)
-                    self.close_connection()
-                    time.sleep(1000)
-        print('Finished recording post statistics')
+                    print(f"Error while fetching posts {i+1} to {min(i+100, len(post_ids))}: {e}")
+                    if attempt < 2:
+                        time.sleep(60)
+
+        self.cursor().executemany("UPDATE chicken_posts SET comments = ?, upvotes = ?, statistics_updated = ?, statistics_next_update = ? WHERE id = ?", statistics)
+        # Posts reddit doesn't return anymore should not use up the budget of every run
+        self.cursor().executemany("UPDATE chicken_posts SET statistics_next_update = ? WHERE id = ?", [(now+MAX_STATISTICS_INTERVAL, post_id) for post_id in missing])
+        self.conn().commit()
+        print(f'Finished recording post statistics of {len(statistics)} posts')
+
+    def get_statistics_freshness(self, n_days_history = 21):
+        # Text for the wiki that says how up to date the upvotes and comments of recent posts are.
+        self.cursor().execute("SELECT MIN(statistics_updated) AS oldest, MAX(statistics_updated) AS newest FROM chicken_posts WHERE timestamp >= ?", (time.time()-n_days_history*24*60*60,))
+        row = self.cursor().fetchone()
+        if row['oldest'] is None:
+            return ""
+        oldest = datetime.fromtimestamp(row['oldest'], timezone.utc).strftime('%Y-%m-%d %H:%M')
+        newest = datetime.fromtimestamp(row['newest'], timezone.utc).strftime('%Y-%m-%d %H:%M')
+        return f" The counts of the posts of the past {n_days_history} days were last refreshed between {oldest} and {newest} (UTC); newer and more active posts are refreshed more often."
 
     def get_text_from_flair(self, text):
         if text is None:
@@ -378,13 +1437,27 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         match = re.match(r'^(.*) - Streak: \d+$', text)
         return match.group(1) if match else text
 
-    def update_user_flair(self, username):
-        self.cursor().execute("SELECT streak, COAD_streak FROM user_streaks WHERE username = ?", (username,))
-        try:
-            streak = max(self.cursor().fetchone())
-        except Exception as e:
-            print(f"Failed to fetch streak for {username}: {e}")
-            return
+    def get_user_flair(self, username, current_flair, streak):
+        # The flair the user should have: their custom flair (if any), followed by their streak.
+        flair_text = self.get_text_from_flair(current_flair)
+
+        user_flair = ""
+        if flair_text != '':
+            user_flair = flair_text + ' - '
+        user_flair += "Streak: " + str(streak)
+        if username == "chickenbotonceaday":
+            user_flair = "Streak: 3.1415926535"
+        return user_flair
+
+    def update_user_flair(self, username, streak = None):
+        # The streak can be given, to avoid looking it up in the database.
+        if streak is None:
+            self.cursor().execute("SELECT streak, COAD_streak FROM user_streaks WHERE username = ?", (username,))
+            try:
+                streak = max(self.cursor().fetchone())
+            except Exception as e:
+                print(f"Failed to fetch streak for {username}: {e}")
+                return
         
         try:
             # Check if the user exists in the subreddit
@@ -394,14 +1467,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
             flair_generator = self.subreddit.flair(username)
             current_flair = next(flair_generator, None)['flair_text']
 
-            flair_text = self.get_text_from_flair(current_flair)
-
-            user_flair = ""
-            if flair_text != '':
-                user_flair = flair_text + ' - '
-            user_flair += "Streak: " + str(streak)
-            if username == "chickenbotonceaday":
-                user_flair = "Streak: 3.1415926535"
+            user_flair = self.get_user_flair(username, current_flair, streak)
 
             # Set the user's flair
             if current_flair != user_flair:
@@ -409,22 +1475,82 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         except Exception as e:
             print(f"Failed to set flair for {username}: {e}")
 
-    def update_all_flair(self):
+    def update_all_flair(self, users = None, bulk = True):
         # Update user flair
+        # If users is given (for example the users whose streak has changed), only their flairs are updated.
+        # In bulk mode, the flairs are read and written in batches (see update_flairs_in_bulk),
+        # otherwise they are read and written one user at a time.
         print("Updating user flairs")
 
-        users = self.get_all_users(keep_open=True)
+        if users is None:
+            users = self.get_all_users(keep_open=True)
+        self.cursor().execute("SELECT username, streak, COAD_streak FROM user_streaks")
+        streaks = {row['username']: (row['streak'], row['COAD_streak']) for row in self.cursor().fetchall()}
 
-        for user_no, user in enumerate(users):                        
-            if (user_no+1) % 20 == 0:
-                print(f"user {user_no+1} out of {len(users)}")
-            self.update_user_flair(user, keep_open = False)
+        user_streaks = {}
+        for user in users:
+            try:
+                user_streaks[user] = max(streaks[user])
+            except Exception as e:
+                print(f"Failed to fetch streak for {user}: {e}")
+
+        if bulk:
+            self.update_flairs_in_bulk(user_streaks, keep_open=True)
+        else:
+            for user_no, (user, streak) in enumerate(user_streaks.items()):
+                if (user_no+1) % 20 == 0:
+                    print(f"user {user_no+1} out of {len(user_streaks)}")
+                self.update_user_flair(user, streak, keep_open = False)
 
         print("Finished updating user flairs")
 
+    def update_flairs_in_bulk(self, streaks):
+        # Sets the flair of every user in streaks (username: streak).
+        # For many users, the current flairs are read from the flair list of the subreddit in one pass
+        # (1000 users per request), for a few users they are read one by one.
+        # Only the flairs that change are sent to reddit, 100 per request.
+        current_flairs = {}
+        failed_users = set()
+        if len(streaks) > 100:
+            for flair in self.subreddit.flair(limit=None):
+                current_flairs[flair['user'].name.lower()] = flair
+        else:
+            for username in streaks:
+                try:
+                    flair = next(self.subreddit.flair(username), None)
+                    if flair is not None:
+                        current_flairs[username.lower()] = flair
+                except Exception as e:
+                    # Without the current flair, its custom text and CSS class would be lost, so the user is skipped
+                    print(f"Failed to fetch flair for {username}: {e}")
+                    failed_users.add(username)
+
+        changes = []
+        for username, streak in streaks.items():
+            if username in failed_users:
+                continue
+            flair = current_flairs.get(username.lower(), {})
+            current_flair = flair.get('flair_text')
+            user_flair = self.get_user_flair(username, current_flair, streak)
+            if current_flair != user_flair:
+                changes.append({'user': username, 'flair_text': user_flair, 'flair_css_class': flair.get('flair_css_class') or ''})
+        print(f"{len(changes)} out of {len(streaks)} user flairs have changed")
+
+        for i in range(0, len(changes), 100):
+            try:
+                for result in self.subreddit.flair.update(changes[i:i+100]):
+                    if not result['ok']:
+                        print(f"Failed to set flair: {result}")
+            except Exception as e:
+                print(f"Failed to set flairs {i+1} to {min(i+100, len(changes))}: {e}")
+
     def get_author(self, submission):
         return submission.author.name if submission.author else "[deleted]"
 
+    def is_removed(self, submission):
+        # Removed by a moderator (or by the bot itself). Not every listing has all of these attributes.
+        return bool(getattr(submission, 'removed', False)) or getattr(submission, 'banned_by', None) is not None or getattr(submission, 'removed_by_category', None) is not None
+
     def update_target_post(self, post_limit=8):
         # Checks the most recent post_limit posts.
         # Checks if it has been manually allowed by a moderator.
@@ -433,56 +1559,67 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         # Checks if the user has not posted 3 times in the last 2 calendar days.
         # Updates the user streak.
         # Updates the post that tells the correct number.
-        current_count = 0
-        if self.subreddit == 'countwithchickenlady':
-            current_count = 21766 # edit to new value after bot failure
-        elif self.subreddit == 'CWCLafterdark':
-            current_count = 531 # edit to new value after bot failure
+        current_count = self.get_count_state(keep_open=True)['count']
 
         print("New check")
-        for submission in reversed(list(self.subreddit.new(limit=post_limit))):
+        submissions = list(reversed(list(self.subreddit.new(limit=post_limit))))
+        decisions = self.get_post_decisions([submission.id for submission in submissions], keep_open=True)
+        reevaluate = False
+        for submission in submissions:
+            # Posts that have been checked before are skipped, unless a moderator approved it after it was removed.
+            # Once a post needs to be checked, all newer posts are checked again as well, since the count might have changed.
+            decision = decisions.get(submission.id)
+            if decision is None or (decision['verdict'] == 'removed' and submission.approved_by is not None):
+                reevaluate = True
+            if not reevaluate:
+                current_count = decision['count']
+                continue
+
             print(f"Checking post {submission.title}")
             self.cursor().execute("SELECT approved FROM chicken_posts WHERE id = ?;", (submission.id,))
             approved = self.cursor().fetchall()
+            verdict = 'ignored'
+
+            if submission.title.isnumeric() and int(submission.title) == current_count and not approved and submission.approved_by is None:
+                # The author of the last count might just have deleted it, in which case this post has the correct number
+                current_count = self.check_count_post_deletion(current_count, keep_open=True)
+
+            self.cursor().execute("SELECT 1 FROM deleted_posts WHERE id = ?;", (submission.id,))
+            early_deleted = self.cursor().fetchone() is not None
 
-            if submission.title.isnumeric():
+            if submission.selftext == "[deleted]" or submission.author is None:
+                # Deleted by its author, so it doesn't count (anymore)
+                print(f"Deleted post detected: {submission.title}")
+            elif early_deleted:
+                # Already handled as an early deletion, so it doesn't count either
+                print(f"Deleted post detected: {submission.title}")
+            elif not approved and submission.approved_by is None and self.is_removed(submission):
+                # Removed by a moderator, the spam filter or the bot itself, before it was accepted.
+                # It is checked again if a moderator approves it later.
+                print(f"Removed post detected: {submission.title}")
+                verdict = 'removed'
+            elif submission.title.isnumeric():
                 post_number = int(submission.title)
                 if post_number == current_count + 1 or current_count == 0:
                     post_was_removed = False
                     deletion_occured = True
                     while deletion_occured:
                         if not approved and submission.approved_by is None:
-                            earlier_posts = pd.read_sql("SELECT id, timestamp, title FROM chicken_posts WHERE username = ? ORDER BY timestamp DESC LIMIT 2", self.conn(), params=(self.get_author(submission),))
-                            earlier_posts.loc[len(earlier_posts)] = [submission.id, submission.created_utc, submission.title]
+                            self.cursor().execute("SELECT id, timestamp, title FROM chicken_posts WHERE username = ? ORDER BY timestamp DESC LIMIT 2", (self.get_author(submission),))
+                            earlier_posts = [{'id': submission.id, 'timestamp': submission.created_utc, 'title': submission.title}]
+                            earlier_posts += [dict(row) for row in self.cursor().fetchall()]
 
-                            # Ensure timestamp is datetime
-                            earlier_posts["datetime"] = pd.to_datetime(earlier_posts["timestamp"], unit='s', utc=True)
-
-                            double_post = True # Check if a user posted twice on the same calendar day
-                            for tz_name in pytz.common_timezones:
-                                tz = pytz.timezone(tz_name)
-                        
-                                # Convert timestamp to the specific timezone
-                                earlier_posts["local_time"] = earlier_posts["datetime"].dt.tz_convert(tz)
-                                earlier_posts["post_date"] = earlier_posts["local_time"].dt.date  # Extract date part
-                                earlier_posts = earlier_posts.sort_values("post_date", ascending = False)
-
-                                # Check if all values in earlier_posts['post_date'] are unique
-                                if earlier_posts["post_date"].is_unique:
-                                    double_post = False
-                                    break
+                            # Check if a user posted twice on the same calendar day
+                            double_post = not posted_on_different_days([row['timestamp'] for row in earlier_posts])
 
                             if double_post:
-                                deletion_found_now = False
-                                for _, row in earlier_posts.iterrows():
-                                    earlier_submission = self.reddit.submission(id=row['id'])
-                                    if (earlier_submission.selftext == "[deleted]" or earlier_submission.author is None) and earlier_submission.created_utc > time.time() - 5*60:
-                                        deletion_found_now = True
-                                        break
-
-                                if deletion_found_now:
-                                    print("Waiting 15 seconds due to post deletion")
-                                    time.sleep(15)
+                                # One of the earlier posts might just have been deleted by its author.
+                                # Those are handled right away, after which the post is checked again.
+                                deleted_posts = [earlier_submission for earlier_submission in self.reddit.info(fullnames=[f"t3_{row['id']}" for row in earlier_posts[1:]])
+                                                 if (earlier_submission.selftext == "[deleted]" or earlier_submission.author is None) and earlier_submission.created_utc > time.time() - 10*60]
+
+                                if deleted_posts and all([self.handle_deleted_post(deleted_post.id, self.get_author(submission), deleted_post.created_utc, refresh_target_post=False, keep_open=True) for deleted_post in deleted_posts]):
+                                    pass
                                 else:
                                     deletion_occured = False
 
@@ -491,7 +1628,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
                                     comment_text = "This post has been removed because of your latest two or three posts, at least two have been on the same calendar day. You may post only once per calendar day. Please wait until the next calendar day to post again.\nThe posts were as follows:\n\n"
                                     now = time.time()
 
-                                    for index, row in earlier_posts.iterrows():
+                                    for row in earlier_posts:
                                         earlier_submission = self.reddit.submission(id=row['id'])
                                         # Convert Unix timestamp to datetime
                                         past = row['timestamp']
@@ -512,15 +1649,23 @@ class ChickenBot(metaclass=AutoPostCallMeta):
                                     submission.mod.send_removal_message(comment_text)
 
                                     post_was_removed = True
+                                    verdict = 'removed'
                             else:
                                 deletion_occured = False
                         else:
                             deletion_occured = False
                     if not post_was_removed:
+                        verdict = 'accepted'
                         current_count = post_number
-                        self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
-                                            (submission.id, self.get_author(submission), submission.created_utc, submission.title))
-                        self.conn().commit()
+                        with self.transaction():
+                            self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
+                                                (submission.id, self.get_author(submission), submission.created_utc, submission.title))
+                            inserted = self.cursor().rowcount == 1
+                            self.set_count_state(current_count, submission.id, submission.created_utc, keep_open=True)
+                            if inserted:
+                                self.add_to_streak_state(self.get_author(submission), submission.id, submission.created_utc, keep_open=True)
+                        if inserted:
+                            self.record_number_properties([submission.id], keep_open=True)
 
                         self.record_streak(self.get_author(submission),keep_open=True)
                         self.update_user_flair(self.get_author(submission),keep_open=True)
@@ -537,14 +1682,23 @@ class ChickenBot(metaclass=AutoPostCallMeta):
                         # Remove the incorrect post
                         submission.mod.remove()
                         submission.mod.send_removal_message(comment_text)
+                        verdict = 'removed'
 
                     else:
+                        verdict = 'accepted'
                         current_count = max(post_number, current_count)
                         
                         # Add new post to database
-                        self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
-                                            (submission.id, self.get_author(submission), submission.created_utc, submission.title))
-                        self.conn().commit()
+                        with self.transaction():
+                            self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
+                                                (submission.id, self.get_author(submission), submission.created_utc, submission.title))
+                            inserted = self.cursor().rowcount == 1
+                            if current_count == post_number:
+                                self.set_count_state(current_count, submission.id, submission.created_utc, keep_open=True)
+                            if inserted:
+                                self.add_to_streak_state(self.get_author(submission), submission.id, submission.created_utc, keep_open=True)
+                        if inserted:
+                            self.record_number_properties([submission.id], keep_open=True)
 
                         self.record_streak(self.get_author(submission),keep_open=True)
                         self.update_user_flair(self.get_author(submission),keep_open=True)
@@ -557,8 +1711,81 @@ class ChickenBot(metaclass=AutoPostCallMeta):
                 # Remove the incorrect post
                 submission.mod.remove()
                 submission.mod.send_removal_message(comment_text)
+                verdict = 'removed'
+
+            self.record_post_decision(submission.id, verdict, current_count, submission.created_utc, keep_open=True)
+
+        if current_count + 1 != self._target_post_count:
+            self.target_post.edit(f"The next number should be: [{current_count + 1}](https://www.reddit.com/r/{self.subredditname}/submit?title={current_count + 1})\n\n^(This comment is automatically updated by a bot. If you think it made a mistake, contact the mods via modmail. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/ChickenBotOnceADay).)")
+            self._target_post_count = current_count + 1
+
+    def get_count_state(self):
+        # The last accepted number, and the id and creation time of that post.
+        self.cursor().execute("SELECT count, post_id, timestamp FROM count_state WHERE id = 1")
+        state = self.cursor().fetchone()
+        if state is None:
+            state = self.refresh_count_state(keep_open=True)
+            if self.connection_state().transaction_depth == 0:
+                # Within a transaction, it is committed together with the rest of the transaction
+                self.conn().commit()
+        return {'count': state['count'], 'post_id': state['post_id'], 'timestamp': state['timestamp']}
+
+    def check_count_post_deletion(self, current_count):
+        # Handles the deletion of the post with the current count, if its author deleted it within 10 minutes.
+        # Returns the count after that.
+        count_state = self.get_count_state(keep_open=True)
+        if count_state['count'] != current_count or count_state['post_id'] is None or count_state['timestamp'] < time.time() - 10*60:
+            return current_count
+        count_post = self.reddit.submission(id=count_state['post_id'])
+        if count_post.selftext != "[deleted]" and count_post.author is not None:
+            return current_count
+        self.cursor().execute("SELECT username FROM chicken_posts WHERE id = ?", (count_post.id,))
+        self.handle_deleted_post(count_post.id, self.cursor().fetchone()['username'], count_post.created_utc, refresh_target_post=False, keep_open=True)
+        return self.get_count_state(keep_open=True)['count']
+
+    def set_count_state(self, count, post_id, timestamp):
+        # Doesn't commit, so it can be part of the same transaction as accepting or deleting the post.
+        self.cursor().execute("INSERT OR REPLACE INTO count_state (id, count, post_id, timestamp) VALUES (1, ?, ?, ?)", (count, post_id, timestamp))
+
+    def refresh_count_state(self):
+        # Looks up the last accepted number in the database, for example after that post has been deleted.
+        # Doesn't commit, just like set_count_state.
+        self.cursor().execute("SELECT id, title, timestamp FROM chicken_posts WHERE title != '' AND title NOT GLOB '*[^0-9]*' ORDER BY timestamp DESC LIMIT 1")
+        post = self.cursor().fetchone()
+        if post is None:
+            state = {'count': 0, 'post_id': None, 'timestamp': None}
+        else:
+            state = {'count': int(post['title']), 'post_id': post['id'], 'timestamp': post['timestamp']}
+        self.set_count_state(state['count'], state['post_id'], state['timestamp'], keep_open=True)
+        return state
+
+    # Every post checked by update_target_post gets a decision: 'accepted', 'removed' or 'ignored'
+    # (a non-numeric post that was approved, or a post that was deleted), together with the count after that post.
+    # These are kept in the database, so a post is only checked once. They are read again on every check,
+    # since other scripts (e.g. updates_deleted_posts.py) can invalidate them.
+
+    def get_post_decisions(self, post_ids = None):
+        # The decisions about the given posts (or about all posts), as a dict post id: decision.
+        if time.time() - self._post_decisions_pruned > 60*60:
+            # Decisions about old posts are not needed anymore
+            self.cursor().execute("DELETE FROM post_decisions WHERE timestamp < ?", (time.time() - 7*24*60*60,))
+            self.conn().commit()
+            self._post_decisions_pruned = time.time()
+        if post_ids is None:
+            self.cursor().execute("SELECT id, verdict, count FROM post_decisions")
+        else:
+            post_ids = list(post_ids)
+            self.cursor().execute(f"SELECT id, verdict, count FROM post_decisions WHERE id IN ({', '.join('?'*len(post_ids))})", post_ids)
+        return {row['id']: {'verdict': row['verdict'], 'count': row['count']} for row in self.cursor().fetchall()}
 
-        self.target_post.edit(f"The next number should be: [{current_count + 1}](https://www.reddit.com/r/{self.subredditname}/submit?title={current_count + 1})\n\n^(This comment is automatically updated by a bot. If you think it made a mistake, contact the mods via modmail. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/ChickenBotOnceADay).)")
+    def record_post_decision(self, post_id, verdict, count, timestamp):
+        self.cursor().execute("INSERT OR REPLACE INTO post_decisions (id, verdict, count, timestamp) VALUES (?, ?, ?, ?)", (post_id, verdict, count, timestamp))
+        self.conn().commit()
+
+    def invalidate_post_decision(self, post_id):
+        # Makes sure the post is checked again by update_target_post, for example after it has been deleted.
+        self.cursor().execute("DELETE FROM post_decisions WHERE id = ?", (post_id,))
+        self.conn().commit()
 
     def add_COAD_streak(self):
         # People who moved from r/CountOnceADay,
@@ -572,9 +1799,11 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         self.cursor().execute("DELETE FROM COAD_posts WHERE username = ?", (username,)) 
         self.conn().commit()
 
-        self.cursor().execute("INSERT INTO COAD_posts (username, post_id, streak) VALUES (?, ?, ?)", (username,post_id,streak_no,))
+        COAD_timestamp = self.reddit.submission(id=post_id).created_utc
+        self.cursor().execute("INSERT INTO COAD_posts (username, post_id, streak, timestamp) VALUES (?, ?, ?, ?)", (username,post_id,streak_no,COAD_timestamp,))
         self.conn().commit()
         
+        self.rebuild_streak_state(username,keep_open=True)
         self.record_streak(username,keep_open=True)
         self.update_user_flair(username, keep_open=True)
         self.record_post_streaks_user(username)
@@ -595,10 +1824,14 @@ class ChickenBot(metaclass=AutoPostCallMeta):
 
     def add_post(self, post_id):
         submission = self.reddit.submission(id=post_id)
-        self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
-                            (submission.id, self.get_author(submission), submission.created_utc, submission.title))
-        self.conn().commit()
-
+        with self.transaction():
+            self.cursor().execute('INSERT OR IGNORE INTO chicken_posts (id, username, timestamp, approved, title) VALUES (?, ?, ?, 1, ?)',
+                                (submission.id, self.get_author(submission), submission.created_utc, submission.title))
+            self.refresh_count_state(keep_open=True)
+            self.rebuild_streak_state(self.get_author(submission),keep_open=True)
+        self.record_number_properties([submission.id], keep_open=True)
+
+        self.invalidate_post_decision(submission.id,keep_open=True)
         self.record_streak(self.get_author(submission),keep_open=True)
         self.update_user_flair(self.get_author(submission),keep_open=True)
         self.record_post_streak(submission.id,replace=False,keep_open=False)
@@ -640,7 +1873,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         self.cursor().execute(f"SELECT * FROM COAD_posts WHERE username = ?", (username,))        
         COAD_post_info = self.cursor().fetchone()
         if COAD_post_info:
-            last_COAD_timestamp = self.reddit.submission(id=COAD_post_info['post_id']).created_utc
+            last_COAD_timestamp, _ = self.get_COAD_info(username, keep_open=True)
             last_COAD_post = datetime.fromtimestamp(last_COAD_timestamp, tz=pytz.timezone(tz_name))
             print(f"COAD post:\nDate/time: {last_COAD_post}, post id: {COAD_post_info['post_id']}, streak: {COAD_post_info['streak']}\n")
 
@@ -659,12 +1892,17 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         self.cursor().execute("SELECT * FROM chicken_posts WHERE id = ?", (post_id,))
         result = self.cursor().fetchone()
 
-        self.cursor().execute("INSERT INTO deleted_posts (id, username, timestamp) VALUES (?, ?, ?)", (post_id, result[1], result[2]))
-        self.cursor().execute("DELETE FROM chicken_posts WHERE id = ?",(post_id,))
-        self.conn().commit()
+        with self.transaction():
+            self.cursor().execute("INSERT INTO deleted_posts (id, username, timestamp) VALUES (?, ?, ?)", (post_id, result[1], result[2]))
+            self.remove_number_properties(post_id, keep_open=True)
+            self.cursor().execute("DELETE FROM chicken_posts WHERE id = ?",(post_id,))
+            if self.get_count_state(keep_open=True)['post_id'] == post_id:
+                self.refresh_count_state(keep_open=True)
+            self.rebuild_streak_state(result[1],keep_open=True)
 
         print("Deleted post from database, now updating user streaks and flair.")
 
+        self.invalidate_post_decision(post_id,keep_open=True)
         self.record_post_streaks_user(result[1],keep_open=True)
         self.record_streak(result[1],keep_open=True)
         self.update_user_flair(result[1])
@@ -678,41 +1916,78 @@ class ChickenBot(metaclass=AutoPostCallMeta):
     def check_for_deleted_posts(self):
         # If someone (including moderators) deletes a post within 10 minute of posting it,
         # it doesn't count for the streak. Otherwise it will.
+        # Checks all posts of the last 10 minutes, see DeletionWatcher for checking each post only once.
         print("Checking for deleted posts")
 
         current_time = int(time.time())
-        df = pd.read_sql("SELECT * FROM chicken_posts WHERE timestamp >= ?", self.conn(), params=(current_time-600,))
-        for _, row in df.iterrows():
-            post_id = row['id']
-            user = row['username']
-            while True:
-                try:
-                    submission = self.reddit.submission(id=post_id)
-                    break
-                except Exception as e:
-                    print(f"Error occurred while fetching submission {post_id}: {e}. Trying again in 10 seconds.")
-                    time.sleep(10)  # Wait a bit before retrying
-
-            print(f"Checking post {submission.title}")
-            if submission.selftext == "[deleted]" or submission.author is None:
-                print("Post has been deleted!")
-                try:
-                    self.cursor().execute("INSERT INTO deleted_posts (id, username, timestamp) VALUES (?, ?, ?)",
-                                          (post_id, user, submission.created_utc))
-                    self.conn().commit()
-                    self.cursor().execute("DELETE FROM chicken_posts WHERE id = ?", (post_id,))
-                    self.conn().commit()
-
-                    self.update_target_post(keep_open=True)
-                    self.record_streak(user,keep_open=True)
-                    self.update_user_flair(user, keep_open=True)
-                    self.record_post_streaks_user(user,keep_open=False)
-                except Exception as e:
-                    print(f'An error occuered when I tried to handle the post deletion. Error message:\n{e}')
+        self.cursor().execute("SELECT id, username FROM chicken_posts WHERE timestamp >= ?", (current_time-600,))
+        users = {row['id']: row['username'] for row in self.cursor().fetchall()}
+        self.check_posts_for_deletion(users, keep_open=True)
+
+    def check_posts_for_deletion(self, users):
+        # Handles the posts (given as a dict post id: username) that have been deleted by their author.
+        # The posts are fetched together, 100 per request. Returns the ids of the posts that could be checked.
+        post_ids = list(users)
+        checked = set()
+        for i in range(0, len(post_ids), 100):
+            try:
+                submissions = list(self.reddit.info(fullnames=[f"t3_{post_id}" for post_id in post_ids[i:i+100]]))
+            except Exception as e:
+                # These posts will be checked again during the next check
+                print(f"Error occurred while fetching posts {i+1} to {min(i+100, len(post_ids))}: {e}")
+                continue
+
+            for submission in submissions:
+                print(f"Checking post {submission.title}")
+                checked.add(submission.id)
+                if submission.selftext == "[deleted]" or submission.author is None:
+                    self.handle_deleted_post(submission.id, users[submission.id], submission.created_utc, keep_open=True)
+        return checked
+
+    def get_posts_due_for_deletion_check(self, start, until):
+        # The posts (post id: (username, timestamp)) created from start until (but not including) until, see DeletionWatcher.
+        self.cursor().execute("SELECT id, username, timestamp FROM chicken_posts WHERE timestamp >= ? AND timestamp < ?", (start, until))
+        return {row['id']: (row['username'], row['timestamp']) for row in self.cursor().fetchall()}
+
+    def handle_moderator_removal(self, post_id, removed_at):
+        # A post that is removed by a moderator within 10 minutes counts as deleted.
+        self.cursor().execute("SELECT username, timestamp FROM chicken_posts WHERE id = ?", (post_id,))
+        row = self.cursor().fetchone()
+        if row is None or removed_at - row['timestamp'] > 600:
+            return False
+        print(f"Post {post_id} has been removed by a moderator")
+        self.handle_deleted_post(post_id, row['username'], row['timestamp'], keep_open=True)
+        return True
+
+    def handle_deleted_post(self, post_id, user, timestamp, refresh_target_post = True):
+        # Removes a post that was deleted within 10 minutes from the database, and updates everything that depends on it.
+        # update_target_post itself uses refresh_target_post = False, since it continues with the new count.
+        print("Post has been deleted!")
+        try:
+            with self.transaction():
+                self.cursor().execute("INSERT INTO deleted_posts (id, username, timestamp) VALUES (?, ?, ?)",
+                                      (post_id, user, timestamp))
+                self.remove_number_properties(post_id, keep_open=True)
+                self.cursor().execute("DELETE FROM chicken_posts WHERE id = ?", (post_id,))
+                if self.get_count_state(keep_open=True)['post_id'] == post_id:
+                    self.refresh_count_state(keep_open=True)
+                self.remove_from_streak_state(user, post_id, keep_open=True)
+            self.invalidate_post_decision(post_id, keep_open=True)
+
+            if refresh_target_post:
+                self.update_target_post(keep_open=True)
+            self.record_streak(user,keep_open=True)
+            self.update_user_flair(user, keep_open=True)
+            self.record_post_streaks_user(user,keep_open=False)
+            return True
+        except Exception as e:
+            print(f'An error occuered when I tried to handle the post deletion. Error message:\n{e}')
+            return False
     
     def start_maintenance(self):
         # Run this code if the bot is not running.
         print('Started maintenance')
+        self._target_post_count = None
         self.target_post.edit(f"The bot is currently under maintenance. Our apologies for the inconvenience. Please [sort by new](https://www.reddit.com/r/{self.subredditname}/new/) to see what the next number in the sequence should be, and use this number as the title for your new post.\n\n^(If you think the bot made a mistake, contact the mods via modmail. The code for this bot is fully open source, and can be found [here](https://github.com/AartvB/ChickenBotOnceADay).)")
 
     def end_maintenance(self):
@@ -720,11 +1995,71 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         print('Ended maintenance')
         self.update_target_post(post_limit=20)
 
-    def update_count_leaderboard(self):
+    def edit_wiki_page(self, page, text, reason, force = False):
+        # Publishes the page, unless it is identical to what was published last time.
+        # The hash of the last published content of every page is stored in the database.
+        # Use force (or forget_wiki_hashes) to publish anyway, e.g. when the page has been edited on reddit.
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.cursor().execute("SELECT hash FROM wiki_pages WHERE page = ?", (page,))
+        row = self.cursor().fetchone()
+        if not force and row is not None and row['hash'] == content_hash:
+            print(f"Wiki page {page} has not changed, not publishing")
+            return False
+
+        self.subreddit.wiki[page].edit(text, reason = reason)
+        self.cursor().execute("INSERT OR REPLACE INTO wiki_pages (page, hash, timestamp) VALUES (?, ?, ?)", (page, content_hash, int(time.time())))
+        self.conn().commit()
+        return True
+
+    def forget_wiki_hashes(self, pages = None):
+        # Makes sure the given wiki pages (default: all) are published on their next update.
+        if pages is None:
+            self.cursor().execute("DELETE FROM wiki_pages")
+        else:
+            self.cursor().executemany("DELETE FROM wiki_pages WHERE page = ?", [(page,) for page in pages])
+        self.conn().commit()
+
+    def get_special_numbers(self):
+        # The first post of every number with trailing zeroes, only identical digits or that is a palindrome.
+        return pd.read_sql('''
+            SELECT c.id, c.username, c.number AS title, c.timestamp, p.trailing_zeroes, p.identical_digits, p.palindrome
+            FROM number_properties p JOIN chicken_posts c ON c.id = p.id
+            WHERE p.first_claim = 1 AND (p.trailing_zeroes > 0 OR p.identical_digits = 1 OR p.palindrome = 1)
+            ORDER BY c.number
+        ''', self.conn())
+
+    def get_leaderboard_snapshot(self):
+        # One read of the tables the hourly leaderboards are built from, shared by all of them.
+        return {
+            'posts': pd.read_sql("SELECT username, current_streak, current_COAD_streak FROM chicken_posts", self.conn()),
+            'streaks': pd.read_sql("SELECT username, streak, COAD_streak FROM user_streaks", self.conn()),
+            'numbers': self.get_special_numbers(keep_open=True)
+        }
+
+    def update_hourly_leaderboards(self):
+        # Updates all hourly leaderboards from a single snapshot of the database.
+        # A failing leaderboard doesn't stop the others from being updated.
+        start = time.time()
+        snapshot = self.get_leaderboard_snapshot()
+        print(f"Loaded leaderboard snapshot in {time.time()-start:.2f}s")
+
+        for leaderboard in ['update_count_leaderboard', 'update_whole_counts_leaderboard', 'update_identical_digits_leaderboard', 'update_streak_leaderboard', 'update_palindrome_leaderboard']:
+            leaderboard_start = time.time()
+            try:
+                getattr(self, leaderboard)(snapshot=snapshot)
+                print(f"{leaderboard} took {time.time()-leaderboard_start:.2f}s")
+            except Exception as e:
+                print(f"{leaderboard} failed after {time.time()-leaderboard_start:.2f}s: {e}")
+        print(f"Updated hourly leaderboards in {time.time()-start:.2f}s")
+
+    def update_count_leaderboard(self, snapshot = None):
         # The leaderboard on the wiki that shows the people with the most posts.
         print("Updating count leaderboard")
+        if snapshot is None:
+            snapshot = self.get_leaderboard_snapshot()
 
-        posts = pd.read_sql("SELECT username, COUNT(*) as counts FROM chicken_posts GROUP BY username ORDER BY counts DESC LIMIT 1000", self.conn())
+        posts = snapshot['posts']['username'].value_counts().head(1000).reset_index()
+        posts.columns = ['username', 'counts']
         posts['rank'] = posts['counts'].rank(method='min', ascending=False).astype(int)
         posts = posts[['rank', 'username', 'counts']]
         posts = posts.rename(columns={'rank':'Rank', 'username':'Username', 'counts':'Counts'})
@@ -732,22 +2067,24 @@ class ChickenBot(metaclass=AutoPostCallMeta):
 
         wiki_text = "#All counters of our beautiful sub!\n\nThis shows the top 1000 posters of our sub!\n\n"+leaderboard
 
-        self.subreddit.wiki['counts'].edit(wiki_text, reason = 'Hourly update')
+        self.edit_wiki_page('counts', wiki_text, reason = 'Hourly update')
 
-    def update_whole_counts_leaderboard(self):
+    def update_whole_counts_leaderboard(self, snapshot = None):
         # The leaderboards on the wiki that shows the people who
         # counted to a multiple of 10, 100, 1000 etc.
         print("Updating whole counts leaderboards")
+        if snapshot is None:
+            snapshot = self.get_leaderboard_snapshot()
+        numbers = snapshot['numbers']
+
         n_zeroes = 1
         while True:
             zeroes_string = n_zeroes*'0'
             print(f"Updating 1{zeroes_string}s leaderboard")
 
-            posts = pd.read_sql("SELECT username, title, id, timestamp FROM chicken_posts WHERE title LIKE ?", self.conn(),params=(f"%{zeroes_string}",))
+            posts = numbers[numbers['trailing_zeroes'] >= n_zeroes].copy()
             if (len(posts) == 0):
                 break
-            posts['title'] = posts['title'].astype('int64')
-            posts = posts.loc[posts.groupby('title')['timestamp'].idxmin().values]
             posts = posts.sort_values("title", ascending = False)
             posts['title'] = posts.apply(lambda row: f"[{row['title']}](https://www.reddit.com/r/{self.subredditname}/comments/{row['id']})", axis=1)
             posts['Date (UTC)'] = pd.to_datetime(posts['timestamp'], unit='s', utc=True).dt.date
@@ -763,7 +2100,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
 
             wiki_text = f"#1{zeroes_string} counts\n\nThis page shows which users have counted to a number divisible by 1{zeroes_string}, and how many times!\n\n"+leaderboard+"\n\n"+full_list
 
-            self.subreddit.wiki[f'1{zeroes_string}s'].edit(wiki_text, reason = f'New 1{zeroes_string} number')
+            self.edit_wiki_page(f'1{zeroes_string}s', wiki_text, reason = f'New 1{zeroes_string} number')
             n_zeroes += 1
 
     def update_top_posts_leaderboards(self):
@@ -773,6 +2110,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         print("Updating top posts leaderboards")
 
         self.record_post_statistics()
+        freshness = self.get_statistics_freshness()
 
         posts = pd.read_sql("SELECT id, username, title, upvotes, comments, timestamp FROM chicken_posts", self.conn())
         posts = posts.rename(columns={'username':'Username', 'title':'Count', 'upvotes':'Upvotes','comments': 'Comments'})
@@ -808,22 +2146,22 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         ranking_comments = ranking_comments[['Rank', 'Username', "Number of appearences in top 100"]]
         appearences_comments_leaderboard = ranking_comments.to_markdown(index=False)
 
-        wiki_text_comments = "#Most comments\n\nThis page shows the posts with the most comments of this sub!\n\nNote: Comment count is stored locally, and will only be updated up to 21 days after the post is posted. Let us know (via mod mail) if the comment count of a specific post has increase significantly since then, so we can update the comment count manually.\n\n##Leaderboard\n"+appearences_comments_leaderboard+"\n\n##Comments\n"+comment_leaderboard
-        self.subreddit.wiki['most_comments'].edit(wiki_text_comments, reason = 'Daily update')
+        wiki_text_comments = "#Most comments\n\nThis page shows the posts with the most comments of this sub!\n\nNote: Comment count is stored locally, and will only be updated up to 21 days after the post is posted. Let us know (via mod mail) if the comment count of a specific post has increase significantly since then, so we can update the comment count manually."+freshness+"\n\n##Leaderboard\n"+appearences_comments_leaderboard+"\n\n##Comments\n"+comment_leaderboard
+        self.edit_wiki_page('most_comments', wiki_text_comments, reason = 'Daily update')
 
-        wiki_text_upvotes = "#Top posts\n\nThis page shows the posts with the most upvotes of this sub!\n\nNote: Upvote count is stored locally, and will only be updated up to 21 days after the post is posted. Let us know (via mod mail) if the upvote count of a specific post has increase significantly since then, so we can update the upvote count manually.\n\n##Leaderboard\n"+appearences_upvotes_leaderboard+"\n\n##Upvotes\n"+upvote_leaderboard
-        self.subreddit.wiki['most_upvotes'].edit(wiki_text_upvotes, reason = 'Daily update')
+        wiki_text_upvotes = "#Top posts\n\nThis page shows the posts with the most upvotes of this sub!\n\nNote: Upvote count is stored locally, and will only be updated up to 21 days after the post is posted. Let us know (via mod mail) if the upvote count of a specific post has increase significantly since then, so we can update the upvote count manually."+freshness+"\n\n##Leaderboard\n"+appearences_upvotes_leaderboard+"\n\n##Upvotes\n"+upvote_leaderboard
+        self.edit_wiki_page('most_upvotes', wiki_text_upvotes, reason = 'Daily update')
 
 
-    def update_identical_digits_leaderboard(self):
+    def update_identical_digits_leaderboard(self, snapshot = None):
         # The leaderboard on the wiki that shows the posts with identical digits.
 
         print("Updating identical digits leaderboard")
+        if snapshot is None:
+            snapshot = self.get_leaderboard_snapshot()
 
-        posts = pd.read_sql("SELECT id, username, title, timestamp FROM chicken_posts", self.conn())
-        posts = posts[posts['title'].str.fullmatch(r'(\d)\1*')]
-        posts['title'] = posts['title'].astype('int64')
-        posts = posts.loc[posts.groupby('title')['timestamp'].idxmin().values]
+        posts = snapshot['numbers']
+        posts = posts[posts['identical_digits'] == 1]
         posts = posts.sort_values("title", ascending = False)
         posts['title'] = posts.apply(lambda row: f"[{row['title']}](https://www.reddit.com/r/{self.subredditname}/comments/{row['id']})", axis=1)
         posts['Date (UTC)'] = pd.to_datetime(posts['timestamp'], unit='s', utc=True).dt.date
@@ -839,16 +2177,16 @@ class ChickenBot(metaclass=AutoPostCallMeta):
 
         wiki_text = "#Identical digits\n\nThis page shows which users have counted to a number that has only identical digits, and how many times!\n\n"+leaderboard+"\n\n"+full_list
 
-        self.subreddit.wiki['identical_digits'].edit(wiki_text, reason = 'New identical digit number')
+        self.edit_wiki_page('identical_digits', wiki_text, reason = 'New identical digit number')
 
-    def update_palindrome_leaderboard(self):
+    def update_palindrome_leaderboard(self, snapshot = None):
         # The leaderboard on the wiki that shows the posts with titles that are palindromes.
         print("Updating palindrome leaderboard")
+        if snapshot is None:
+            snapshot = self.get_leaderboard_snapshot()
 
-        posts = pd.read_sql("SELECT id, username, title, timestamp FROM chicken_posts", self.conn())
-        posts = posts[posts['title'] == posts['title'].str[::-1]]
-        posts['title'] = posts['title'].astype('int64')
-        posts = posts.loc[posts.groupby('title')['timestamp'].idxmin().values]
+        posts = snapshot['numbers']
+        posts = posts[posts['palindrome'] == 1]
         posts = posts.sort_values("title", ascending = False)
         posts['title'] = posts.apply(lambda row: f"[{row['title']}](https://www.reddit.com/r/{self.subredditname}/comments/{row['id']})", axis=1)
         posts['Date (UTC)'] = pd.to_datetime(posts['timestamp'], unit='s', utc=True).dt.date
@@ -864,13 +2202,20 @@ class ChickenBot(metaclass=AutoPostCallMeta):
 
         wiki_text = "#Palindromes\n\nThis page shows which users have counted to palindrome numbers (numbers that are the same backwards as forwards), and how many times!\n\n"+leaderboard+"\n\n"+full_list
 
-        self.subreddit.wiki['palindrome_numbers'].edit(wiki_text, reason = 'New palindrome number')
+        self.edit_wiki_page('palindrome_numbers', wiki_text, reason = 'New palindrome number')
 
-    def update_streak_leaderboard(self):
+    def update_streak_leaderboard(self, snapshot = None):
         # The leaderboard on the wiki that shows the people with the highest streaks
         print("Updating streak leaderboard")
-
-        current_streaks = pd.read_sql("SELECT username, streak, COAD_streak FROM user_streaks", self.conn())
+        if snapshot is None:
+            snapshot = self.get_leaderboard_snapshot()
+
+        current_streaks = snapshot['streaks']
+        max_streaks = snapshot['posts'].groupby('username')[['current_streak', 'current_COAD_streak']].max().reset_index()
+        # Posts without a recorded streak make the columns floats, while only users without any streak need them to be
+        for column in ['current_streak', 'current_COAD_streak']:
+            if not max_streaks[column].isna().any():
+                max_streaks[column] = max_streaks[column].astype('int64')
     
         current_normal_streaks = current_streaks.sort_values("streak", ascending = False).head(100)
         current_normal_streaks = current_normal_streaks.rename(columns={'username':'Username', 'streak':'Streak'})
@@ -888,7 +2233,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         current_COAD_streaks = current_COAD_streaks[current_COAD_streaks['Streak'] > 0]
         current_COAD_streaks = current_COAD_streaks.to_markdown(index=False)
 
-        max_normal_streaks = pd.read_sql("SELECT username, MAX(current_streak) as streak FROM chicken_posts GROUP BY username", self.conn())
+        max_normal_streaks = max_streaks[['username', 'current_streak']].rename(columns={'current_streak':'streak'})
         max_normal_streaks = max_normal_streaks.sort_values("streak", ascending = False).head(100)
         max_normal_streaks = max_normal_streaks.rename(columns={'username':'Username', 'streak':'Streak'})
         max_normal_streaks['Rank'] = max_normal_streaks['Streak'].rank(method='min', ascending=False).astype(int)
@@ -896,7 +2241,7 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         max_normal_streaks = max_normal_streaks[max_normal_streaks['Streak'] > 0]
         max_normal_streaks = max_normal_streaks.to_markdown(index=False)
 
-        max_COAD_streaks = pd.read_sql("SELECT username, MAX(current_streak) AS max_current_streak, MAX(current_COAD_streak) as max_current_COAD_streak FROM chicken_posts GROUP BY username", self.conn())
+        max_COAD_streaks = max_streaks.rename(columns={'current_streak':'max_current_streak', 'current_COAD_streak':'max_current_COAD_streak'})
         max_COAD_streaks['Streak'] = max_COAD_streaks[['max_current_streak', 'max_current_COAD_streak']].max(axis=1)
         max_COAD_streaks = max_COAD_streaks.sort_values("Streak", ascending = False).head(100)
         max_COAD_streaks = max_COAD_streaks.rename(columns={'username':'Username'})
@@ -909,106 +2254,104 @@ class ChickenBot(metaclass=AutoPostCallMeta):
         if self.subreddit == 'countwithchickenlady':
             wiki_text += "\n\n##This sub and r/CountOnceADay\n\nThis shows the top streaks built up in this sub and possibly carried over from r/CountOnceADay.\n\n###Currently running streaks\n"+current_COAD_streaks+"\n\n###Top streaks ever\n"+max_COAD_streaks
 
-        self.subreddit.wiki['top_streaks'].edit(wiki_text, reason = 'Hourly update')
+        self.edit_wiki_page('top_streaks', wiki_text, reason = 'Hourly update')
         
-    def export_database_to_JSON(self):
+    def export_database_to_JSON(self, chunk_size = 50000):
         # Export the database to JSON format, so that it can be used for the redis implementation of this bot.
+        # The file is written section by section (see JSONWriter), and the posts are read chunk_size at a time,
+        # so the memory use doesn't grow with the number of posts.
         print("Exporting database to JSON")
 
-        posts = pd.read_sql("SELECT * FROM chicken_posts", self.conn())
+        self.backfill_COAD_timestamps(keep_open=True)
         COAD_posts = pd.read_sql("SELECT * FROM COAD_posts", self.conn())
         user_streaks = pd.read_sql("SELECT * FROM user_streaks", self.conn())
-        deleted_posts = pd.read_sql("SELECT * FROM deleted_posts", self.conn())
-
-        unique_users = posts['username'].unique()
-
-        print("Starting export to JSON")
-        result = {}
-        print("Exporting users")
-        result['users'] = [{'member': user, 'score': i} for i, user in enumerate(unique_users)]
-        print("Exporting posts")
-        result['posts'] = [{'member': f"t3_{row['id']}", 'score': row['timestamp']*1000} for _, row in posts.iterrows()]
-        print("Exporting early deleted posts")
-        result['early_deleted_posts'] = [{'member': f"t3_{row['id']}", 'score': row['timestamp']*1000} for _, row in deleted_posts.iterrows()]
-        print("Exporting current streaks")
-        result['current_streaks'] = [{'member': row['username'], 'score': row['streak']} for _, row in user_streaks.iterrows()]
-        print("Exporting current COAD streaks")
-        result['current_COAD_streaks'] = [{'member': row['username'], 'score': int(row['COAD_streak']) if not np.isnan(row['COAD_streak']) else 0} for _, row in user_streaks.iterrows()]
-        print("Exporting post streaks")
-        result['post_streaks'] = [{'member': f"t3_{row['id']}", 'score': row['current_streak']} for _, row in posts.iterrows()]
-        print("Exporting post COAD streaks")
-        result['post_COAD_streaks'] = [{'member': f"t3_{row['id']}", 'score': int(row['current_COAD_streak']) if not np.isnan(row['current_COAD_streak']) else 0} for _, row in posts.iterrows()]
-        print("Exporting top streaks")
-        top_streaks = pd.read_sql("SELECT username, MAX(current_streak) as streak FROM chicken_posts GROUP BY username ORDER BY streak DESC LIMIT 1000", self.conn())
-        result['top_streaks'] = [{'member': row['username'], 'score': row['streak']} for _, row in top_streaks.iterrows()]
-        print("Exporting top COAD streaks")
-        top_COAD_streaks = pd.read_sql("SELECT username, MAX(current_streak) AS max_current_streak, MAX(current_COAD_streak) as max_current_COAD_streak FROM chicken_posts GROUP BY username", self.conn())
-        result['top_COAD_streaks'] = [{'member': row['username'], 'score': max(row['max_current_streak'], row['max_current_COAD_streak'])} for _, row in top_COAD_streaks.iterrows()]
-        print("Exporting top upvoted posts")
-        top_upvoted_posts = pd.read_sql("SELECT id, upvotes FROM chicken_posts ORDER BY upvotes DESC LIMIT 1000", self.conn())
-        result['post_upvotes'] = [{'member': f"t3_{row['id']}", 'score': row['upvotes']} for _, row in top_upvoted_posts.iterrows()]
-        print("Exporting top commented posts")
-        top_commented_posts = pd.read_sql("SELECT id, comments FROM chicken_posts ORDER BY comments DESC LIMIT 1000", self.conn())
-        result['post_comments'] = [{'member': f"t3_{row['id']}", 'score': row['comments']} for _, row in top_commented_posts.iterrows()]
-        print("Exporting posts per user")
-        result['posts_per_user'] = [{'member': row['username'], 'score': row['counts']} for _, row in pd.read_sql("SELECT username, COUNT(*) as counts FROM chicken_posts GROUP BY username", self.conn()).iterrows()]
-
-        print("Exporting posts with identical digits")
-        identical_posts = posts[posts['title'].str.fullmatch(r'(\d)\1*')].copy()
-        identical_posts['title'] = identical_posts['title'].astype('int64')
-        identical_posts = identical_posts.loc[identical_posts.groupby('title')['timestamp'].idxmin().values]
-        result['identical_digits_posts'] = [{'member': f"t3_{row['id']}", 'score': row['title']} for _, row in identical_posts.iterrows()]
-        print("Exporting users with identical digits posts")
-        identical_posts_count = identical_posts['username'].value_counts()
-        result['identical_digits_users'] = [{'member': user, 'score': count} for user, count in identical_posts_count.items()]
-
-        print("Exporting palindrome posts")
-        palindrome_posts = posts[posts['title'] == posts['title'].str[::-1]].copy()
-        palindrome_posts['title'] = palindrome_posts['title'].astype('int64')
-        palindrome_posts = palindrome_posts.loc[palindrome_posts.groupby('title')['timestamp'].idxmin().values]
-        result['palindrome_posts'] = [{'member': f"t3_{row['id']}", 'score': row['title']} for _, row in palindrome_posts.iterrows()]
-        print("Exporting users with palindrome posts")
-        palindrome_posts_count = palindrome_posts['username'].value_counts()
-        result['palindrome_users'] = [{'member': user, 'score': count} for user, count in palindrome_posts_count.items()]        
-
-        print("Exporting current count")
-        result['current_count'] = int(pd.read_sql("SELECT title FROM chicken_posts ORDER BY timestamp DESC LIMIT 1", self.conn()).iloc[0]['title'])
-
-        print("Exporting posts per user")
-        result['posts_of'] = {}
-        for user in unique_users:
-            user_posts = posts[posts['username'] == user]
-            result['posts_of'][user] = [{'member': f"t3_{row['id']}", 'score': row['timestamp']*1000} for _, row in user_posts.iterrows()]
-
-        print("Exporting whole counts")
-        result['whole_count_posts'] = {}
-        result['whole_count_users'] = {}
-        n_zeroes = 1
-        while True:
-            zeroes_string = n_zeroes*'0'
-
-            whole_count_posts = pd.read_sql("SELECT username, title, id, timestamp FROM chicken_posts WHERE title LIKE ?", self.conn(),params=(f"%{zeroes_string}",))
-            if (len(whole_count_posts) == 0):
-                break
-            whole_count_posts['title'] = whole_count_posts['title'].astype('int64')
-            whole_count_posts = whole_count_posts.loc[whole_count_posts.groupby('title')['timestamp'].idxmin().values]
-            result['whole_count_posts'][f'1{zeroes_string}'] = [{'member': f"t3_{row['id']}", 'score': row['title']} for _, row in whole_count_posts.iterrows()]
-            whole_count_posts_count = whole_count_posts['username'].value_counts()
-            result['whole_count_users'][f'1{zeroes_string}'] = [{'member': user, 'score': count} for user, count in whole_count_posts_count.items()]    
-
-            n_zeroes += 1
+        special_numbers = self.get_special_numbers(keep_open=True)
 
-        print("Exporting post info")
-        result['post_info'] = {}
-        for post in posts.itertuples():
-            result['post_info'][f"t3_{post.id}"] = json.dumps({'authorName': post.username, 'postNumber': post.title, 'date': datetime.fromtimestamp(post.timestamp, tz=timezone.utc).strftime('%Y-%m-%d')})
+        def post_chunks(query):
+            return pd.read_sql(query, self.conn(), chunksize=chunk_size)
 
-        print("Exporting COAD streaks")
-        result['other_streaks_of'] = {}
-        for coad_post in COAD_posts.itertuples():
-            post = self.reddit.submission(id=coad_post.post_id)
-            result['other_streaks_of'][coad_post.username] = json.dumps([{'streak': coad_post.streak, 'source':'COAD', 'timestamp': int(post.created_utc*1000)}])
+        def ranking(members, scores):
+            return [{'member': member, 'score': score} for member, score in zip(members, scores)]
 
-        print("Writing to file")
         with open('chickenbot_database.json', 'w') as f:
-            json.dump(result, f, indent=2)
\ No newline at end of file
+            writer = JSONWriter(f)
+            print("Exporting users")
+            # In the order of their first post
+            self.cursor().execute("SELECT username FROM chicken_posts GROUP BY username ORDER BY MIN(rowid)")
+            unique_users = [row['username'] for row in self.cursor().fetchall()]
+            writer.write('users', ranking(unique_users, range(len(unique_users))))
+            print("Exporting posts")
+            writer.write_chunks('posts', (ranking(('t3_' + chunk['id']).tolist(), (chunk['timestamp']*1000).tolist()) for chunk in post_chunks("SELECT id, timestamp FROM chicken_posts")))
+            print("Exporting early deleted posts")
+            writer.write_chunks('early_deleted_posts', (ranking(('t3_' + chunk['id']).tolist(), (chunk['timestamp']*1000).tolist()) for chunk in post_chunks("SELECT id, timestamp FROM deleted_posts")))
+            print("Exporting current streaks")
+            writer.write('current_streaks', ranking(user_streaks['username'].tolist(), user_streaks['streak'].tolist()))
+            print("Exporting current COAD streaks")
+            writer.write('current_COAD_streaks', ranking(user_streaks['username'].tolist(), user_streaks['COAD_streak'].fillna(0).astype(int).tolist()))
+            print("Exporting post streaks")
+            writer.write_chunks('post_streaks', (ranking(('t3_' + chunk['id']).tolist(), integers_or_nan(chunk['current_streak'])) for chunk in post_chunks("SELECT id, current_streak FROM chicken_posts")))
+            print("Exporting post COAD streaks")
+            writer.write_chunks('post_COAD_streaks', (ranking(('t3_' + chunk['id']).tolist(), chunk['current_COAD_streak'].fillna(0).astype(int).tolist()) for chunk in post_chunks("SELECT id, current_COAD_streak FROM chicken_posts")))
+            print("Exporting top streaks")
+            top_streaks = pd.read_sql("SELECT username, MAX(current_streak) as streak FROM chicken_posts GROUP BY username ORDER BY streak DESC LIMIT 1000", self.conn())
+            writer.write('top_streaks', ranking(top_streaks['username'].tolist(), top_streaks['streak'].tolist()))
+            print("Exporting top COAD streaks")
+            top_COAD_streaks = pd.read_sql("SELECT username, MAX(current_streak) AS max_current_streak, MAX(current_COAD_streak) as max_current_COAD_streak FROM chicken_posts GROUP BY username", self.conn())
+            writer.write('top_COAD_streaks', ranking(top_COAD_streaks['username'].tolist(), [max(streak, COAD_streak) for streak, COAD_streak in zip(top_COAD_streaks['max_current_streak'].tolist(), top_COAD_streaks['max_current_COAD_streak'].tolist())]))
+            print("Exporting top upvoted posts")
+            top_upvoted_posts = pd.read_sql("SELECT id, upvotes FROM chicken_posts ORDER BY upvotes DESC LIMIT 1000", self.conn())
+            writer.write('post_upvotes', ranking(('t3_' + top_upvoted_posts['id']).tolist(), top_upvoted_posts['upvotes'].tolist()))
+            print("Exporting top commented posts")
+            top_commented_posts = pd.read_sql("SELECT id, comments FROM chicken_posts ORDER BY comments DESC LIMIT 1000", self.conn())
+            writer.write('post_comments', ranking(('t3_' + top_commented_posts['id']).tolist(), top_commented_posts['comments'].tolist()))
+            print("Exporting posts per user")
+            post_counts = pd.read_sql("SELECT username, COUNT(*) as counts FROM chicken_posts GROUP BY username", self.conn())
+            writer.write('posts_per_user', ranking(post_counts['username'].tolist(), post_counts['counts'].tolist()))
+
+            print("Exporting posts with identical digits")
+            identical_posts = special_numbers[special_numbers['identical_digits'] == 1]
+            writer.write('identical_digits_posts', ranking(('t3_' + identical_posts['id']).tolist(), identical_posts['title'].tolist()))
+            print("Exporting users with identical digits posts")
+            identical_posts_count = identical_posts['username'].value_counts()
+            writer.write('identical_digits_users', ranking(identical_posts_count.index.tolist(), identical_posts_count.tolist()))
+
+            print("Exporting palindrome posts")
+            palindrome_posts = special_numbers[special_numbers['palindrome'] == 1]
+            writer.write('palindrome_posts', ranking(('t3_' + palindrome_posts['id']).tolist(), palindrome_posts['title'].tolist()))
+            print("Exporting users with palindrome posts")
+            palindrome_posts_count = palindrome_posts['username'].value_counts()
+            writer.write('palindrome_users', ranking(palindrome_posts_count.index.tolist(), palindrome_posts_count.tolist()))
+
+            print("Exporting current count")
+            writer.write('current_count', int(pd.read_sql("SELECT title FROM chicken_posts ORDER BY timestamp DESC LIMIT 1", self.conn()).iloc[0]['title']))
+
+            print("Exporting posts per user")
+            writer.write_chunks('posts_of', posts_per_user(self.conn(), chunk_size), kind=dict)
+
+            print("Exporting whole counts")
+            whole_count_posts = {}
+            whole_count_users = {}
+            n_zeroes = 1
+            while True:
+                posts = special_numbers[special_numbers['trailing_zeroes'] >= n_zeroes]
+                if len(posts) == 0:
+                    break
+                whole_count_posts[f"1{n_zeroes*'0'}"] = ranking(('t3_' + posts['id']).tolist(), posts['title'].tolist())
+                posts_count = posts['username'].value_counts()
+                whole_count_users[f"1{n_zeroes*'0'}"] = ranking(posts_count.index.tolist(), posts_count.tolist())
+                n_zeroes += 1
+            writer.write('whole_count_posts', whole_count_posts)
+            writer.write('whole_count_users', whole_count_users)
+
+            print("Exporting post info")
+            def post_info(chunk):
+                dates = pd.to_datetime(chunk['timestamp'], unit='s', utc=True).dt.strftime('%Y-%m-%d')
+                return {f"t3_{post_id}": json.dumps({'authorName': username, 'postNumber': title, 'date': date})
+                        for post_id, username, title, date in zip(chunk['id'].tolist(), chunk['username'].tolist(), chunk['title'].tolist(), dates.tolist())}
+            writer.write_chunks('post_info', (post_info(chunk) for chunk in post_chunks("SELECT id, username, title, timestamp FROM chicken_posts")), kind=dict)
+
+            print("Exporting COAD streaks")
+            writer.write('other_streaks_of', {username: json.dumps([{'streak': streak, 'source':'COAD', 'timestamp': int(timestamp*1000)}])
+                                              for username, streak, timestamp in zip(COAD_posts['username'].tolist(), COAD_posts['streak'].tolist(), COAD_posts['timestamp'].tolist())})
+            writer.close()
+        print("Finished exporting database to JSON")
\ No newline at end of file
@@ -0,0 +1,306 @@
+# Measures how long the moderation takes: from the moment a post arrives, to the moment the bot has accepted
+# or removed it and has updated the post that tells the correct number.
+# - record: records the submissions, approvals and deletions on the subreddit to a file (JSON lines).
+# - synthesize: writes a synthetic sequence to a file, with count races, wrong numbers, double posts, approvals and deletions.
+# - replay: replays a file against a local stand-in for reddit (see benchmark.FakeReddit), and reports the
+#   p50/p95/p99 latency of the decisions and the number of reddit requests per decision.
+#
+# Examples:
+# python replay_moderation.py synthesize race.jsonl --posts 500 --rate 0.5
+# python replay_moderation.py replay race.jsonl --speed 10 --api-latency 0.3
+# python replay_moderation.py record recorded.jsonl --duration 3600
+
+from benchmark import FakeReddit, make_bot, current_commit
+from chickenbot import ChickenBot, DeletionWatcher
+import chickenbot
+import numpy as np
+import argparse
+import contextlib
+import tempfile
+import shutil
+import json
+import time
+import os
+
+# Events in a recording, besides the 'start' line with the count at the start:
+# {'time': seconds since the start, 'type': 'submission', 'id', 'title', 'author'}
+#   Instead of a title, a synthetic submission can have 'next': the title is then the count at the moment the post arrives plus next,
+#   like a user who reads the number from the post that tells the correct number.
+# {'time': ..., 'type': 'approval', 'id'}: a moderator approved the post
+# {'time': ..., 'type': 'deletion', 'id'}: the author deleted the post
+
+def write_recording(path, count, events):
+    with open(path, 'w') as f:
+        f.write(json.dumps({'type': 'start', 'count': count}) + "\n")
+        for event in sorted(events, key=lambda event: event['time']):
+            f.write(json.dumps(event) + "\n")
+
+def read_recording(path):
+    with open(path) as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    return lines[0]['count'], lines[1:]
+
+def record(path, duration):
+    # Records what happens on the subreddit. The deletions are found the same way the bot finds them:
+    # posts are checked until they are 10 minutes old.
+    cb = ChickenBot()
+    count = cb.get_count_state()['count']
+    submissions = cb.subreddit.stream.submissions(skip_existing=True, pause_after=0)
+    mod_log = cb.subreddit.mod.stream.log(action='approvelink', skip_existing=True, pause_after=0)
+    start = time.time()
+    recent = {} # Post id: time it arrived
+    deleted = set()
+    last_deletion_check = start
+    with open(path, 'w') as f:
+        def write(event):
+            event['time'] = time.time() - start
+            f.write(json.dumps(event) + "\n")
+            f.flush()
+        f.write(json.dumps({'type': 'start', 'count': count}) + "\n")
+        print(f"Recording for {duration} seconds, the count is {count}")
+        while time.time() - start < duration:
+            try:
+                for submission in submissions:
+                    if submission is None:
+                        break
+                    write({'type': 'submission', 'id': submission.id, 'title': submission.title, 'author': cb.get_author(submission)})
+                    recent[submission.id] = time.time()
+                for action in mod_log:
+                    if action is None:
+                        break
+                    write({'type': 'approval', 'id': action.target_fullname[3:]})
+                if time.time() - last_deletion_check >= 15:
+                    last_deletion_check = time.time()
+                    recent = {post_id: arrived for post_id, arrived in recent.items() if arrived > time.time() - 10*60}
+                    if recent:
+                        for submission in cb.reddit.info(fullnames=[f"t3_{post_id}" for post_id in recent]):
+                            if (submission.selftext == "[deleted]" or submission.author is None) and submission.id not in deleted:
+                                deleted.add(submission.id)
+                                write({'type': 'deletion', 'id': submission.id})
+            except Exception as e:
+                print(f"Error while recording: {e}")
+                time.sleep(30)
+            time.sleep(1)
+    print(f"Recorded to {path}")
+
+def synthesize(path, posts, rate, users, seed, count):
+    # Posts arrive at random (on average rate per second). Sometimes several users race for the same number.
+    rng = np.random.default_rng(seed)
+    events = []
+    t = 0
+    author = None
+    for i in range(posts):
+        t += rng.exponential(1/rate)
+        kind = rng.random()
+        if kind < 0.15:
+            # A count race: a few users post the next number within seconds
+            for j in range(int(rng.integers(2, 5))):
+                events.append({'time': t + rng.uniform(0, 5), 'type': 'submission', 'id': f"race{i}_{j}", 'next': 1, 'author': f"user{rng.integers(users)}"})
+            continue
+        # Some users post twice in a row
+        author = author if author is not None and rng.random() < 0.03 else f"user{rng.integers(users)}"
+        post_id = f"post{i}"
+        event = {'time': t, 'type': 'submission', 'id': post_id, 'author': author}
+        if kind < 0.85:
+            event['next'] = 1
+        elif kind < 0.95:
+            event['next'] = int(rng.integers(2, 100))
+        else:
+            event['title'] = 'Not a number'
+            if rng.random() < 0.2:
+                events.append({'time': t + rng.uniform(60, 300), 'type': 'approval', 'id': post_id})
+        events.append(event)
+        if rng.random() < 0.03:
+            events.append({'time': t + rng.uniform(10, 600), 'type': 'deletion', 'id': post_id})
+    write_recording(path, count, events)
+    print(f"Wrote {len(events)} events to {path}")
+
+class ReplayTime:
+    # Takes the place of the time module within chickenbot during a replay. time() follows the clock of the replay,
+    # at the pace of the recording, so the bot sees the same calendar days and 10 minute windows as when it was recorded.
+    def __init__(self, start, speed):
+        self.start = start
+        self.speed = speed
+        self.clock = 0
+
+    def time(self):
+        return self.start + self.clock*self.speed
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def seed_database(cb, count, timestamp):
+    # The last accepted post has the count at the start of the recording
+    cb.cursor().execute("INSERT OR REPLACE INTO chicken_posts (id, username, timestamp, title) VALUES ('replaystart', '[replay]', ?, ?)", (timestamp, str(count)))
+    cb.set_count_state(count, 'replaystart', timestamp, keep_open=True)
+    cb.conn().commit()
+
+def percentiles(values):
+    if not values:
+        return {}
+    return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95)), 'p99': float(np.percentile(values, 99)), 'max': float(max(values)), 'mean': float(np.mean(values))}
+
+def replay(path, db, speed, api_latency, coalesce, sleep, deletion_checks):
+    # The bot runs like total_update.py: for every new submission, update_target_post is called
+    # (with coalesce, like bot_daemon.py: once for all submissions that came in meanwhile).
+    # The clock is virtual: while the bot is idle, it jumps to the next event (unless sleep is set),
+    # while the bot is busy it runs in real time. So the replay is as fast as possible, but the
+    # latencies are the same as when the events would have come in at their (accelerated) times.
+    # The latencies are in real seconds, the clock of the bot runs speed times faster (see ReplayTime).
+    count, events = read_recording(path)
+    replay_time = ReplayTime(time.time(), speed)
+
+    directory = tempfile.mkdtemp()
+    reddit = FakeReddit('replay', latency=api_latency)
+    cb = make_bot(os.path.join(directory, 'replay'), reddit)
+    if db is not None:
+        shutil.copy(db+'.db', cb.db+'.db')
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        cb.setup_database()
+        seed_database(cb, count, int(replay_time.start) - 24*60*60)
+    watcher = DeletionWatcher(cb, events=[]) if deletion_checks else None
+
+    arrivals = {} # Post id: (virtual) time it arrived
+    approvals = {} # Post id: (virtual) time it was approved
+    latencies = []
+    approval_latencies = []
+    verdicts = {}
+    requests_per_update = []
+    decisions_per_update = []
+    clock = 0
+    next_event = 0
+    next_deletion_check = 15/speed
+    pending = 0
+    errors = 0
+    chickenbot.time = replay_time
+    try:
+        while next_event < len(events) or pending:
+            if not pending:
+                wait = events[next_event]['time']/speed - clock
+                if sleep and wait > 0:
+                    time.sleep(wait)
+                clock = max(clock, events[next_event]['time']/speed)
+                replay_time.clock = clock
+            while next_event < len(events) and events[next_event]['time']/speed <= clock:
+                event = events[next_event]
+                next_event += 1
+                if event['type'] == 'submission':
+                    title = event['title'] if 'next' not in event else str(cb.get_count_state()['count'] + event['next'])
+                    reddit.submit(event['id'], title, event['author'], replay_time.start + event['time'])
+                    arrivals[event['id']] = event['time']/speed
+                    pending += 1
+                elif event['id'] in reddit.submissions:
+                    submission = reddit.submissions[event['id']]
+                    if event['type'] == 'approval':
+                        submission.approved_by = 'moderator'
+                        approvals[event['id']] = event['time']/speed
+                    elif event['type'] == 'deletion':
+                        submission.selftext = "[deleted]"
+                        submission.author = None
+
+            updates = 1 if coalesce else pending
+            pending = 0
+            for _ in range(updates):
+                requests = reddit.total_requests()
+                decisions = dict(cb.get_post_decisions())
+                start = time.perf_counter()
+                error = None
+                with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                    try:
+                        cb.update_target_post()
+                    except Exception as e:
+                        error = e
+                clock += time.perf_counter() - start
+                replay_time.clock = clock
+                if error is not None:
+                    errors += 1
+                    print(f"Error in execution: {error}")
+                new_decisions = {post_id: decision for post_id, decision in cb.get_post_decisions().items() if decisions.get(post_id) != decision}
+                for post_id, decision in new_decisions.items():
+                    if post_id in arrivals:
+                        latencies.append(clock - arrivals.pop(post_id))
+                        verdicts[decision['verdict']] = verdicts.get(decision['verdict'], 0) + 1
+                    if post_id in approvals and decision['verdict'] != 'removed':
+                        approval_latencies.append(clock - approvals.pop(post_id))
+                requests_per_update.append(reddit.total_requests() - requests)
+                decisions_per_update.append(len(new_decisions))
+
+            if watcher is not None and clock >= next_deletion_check:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                    watcher.step()
+                clock += time.perf_counter() - start
+                replay_time.clock = clock
+                next_deletion_check = clock + 15/speed
+    finally:
+        chickenbot.time = time
+        cb.close_connection()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    decisions = sum(decisions_per_update)
+    return {
+        'submissions': sum(event['type'] == 'submission' for event in events),
+        'decisions': decisions,
+        # Posts that were never checked, because too many posts came in at once (see post_limit of update_target_post)
+        'undecided': len(arrivals),
+        'verdicts': verdicts,
+        'latency': percentiles(latencies),
+        'approval_latency': percentiles(approval_latencies),
+        'updates': len(requests_per_update),
+        'errors': errors,
+        'requests_per_decision': sum(requests_per_update)/decisions if decisions else None,
+        'requests_per_update': percentiles(requests_per_update),
+        'requests': dict(reddit.requests)
+    }
+
+def print_report(report):
+    print(f"{report['submissions']} submissions, {report['decisions']} decisions, {report['undecided']} posts never checked, {report['updates']} updates, {report['errors']} errors")
+    print(f"Verdicts: {report['verdicts']}")
+    for name in ['latency', 'approval_latency']:
+        if report[name]:
+            print(f"{name:<20}" + "  ".join(f"{key} {value:.3f}s" for key, value in report[name].items()))
+    if report['requests_per_decision'] is not None:
+        print(f"Reddit requests per decision: {report['requests_per_decision']:.2f}, per update: p50 {report['requests_per_update']['p50']:.0f}, p95 {report['requests_per_update']['p95']:.0f}")
+    print(f"Reddit requests: {report['requests']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and replay the moderation of the bot, and measure its latency.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help="record the submissions, approvals and deletions on the subreddit")
+    record_parser.add_argument('file')
+    record_parser.add_argument('--duration', type=float, default=60*60, help="seconds")
+
+    synthesize_parser = commands.add_parser('synthesize', help="write a synthetic recording")
+    synthesize_parser.add_argument('file')
+    synthesize_parser.add_argument('--posts', type=int, default=500)
+    synthesize_parser.add_argument('--rate', type=float, default=1/60, help="posts per second")
+    synthesize_parser.add_argument('--users', type=int, default=1000)
+    synthesize_parser.add_argument('--seed', type=int, default=1)
+    synthesize_parser.add_argument('--count', type=int, default=100000, help="the count at the start")
+
+    replay_parser = commands.add_parser('replay', help="replay a recording against a fake reddit")
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--db', help="a copy of this database is used (without .db), e.g. one generated by benchmark.py")
+    replay_parser.add_argument('--speed', type=float, default=1, help="replay this many times faster than recorded")
+    replay_parser.add_argument('--api-latency', type=float, default=0, help="seconds every reddit request takes")
+    replay_parser.add_argument('--coalesce', action='store_true', help="one update for all posts that came in meanwhile, like bot_daemon.py")
+    replay_parser.add_argument('--sleep', action='store_true', help="wait for the events in real time, instead of skipping the idle time")
+    replay_parser.add_argument('--deletion-checks', action='store_true', help="also check for deleted posts every 15 seconds, in the same thread")
+    replay_parser.add_argument('--report', help="add the report to this file (JSON lines)")
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.file, args.duration)
+    elif args.command == 'synthesize':
+        synthesize(args.file, args.posts, args.rate, args.users, args.seed, args.count)
+    else:
+        report = replay(args.file, args.db, args.speed, args.api_latency, args.coalesce, args.sleep, args.deletion_checks)
+        print_report(report)
+        if args.report:
+            settings = {'file': args.file, 'db': args.db, 'speed': args.speed, 'api_latency': args.api_latency, 'coalesce': args.coalesce, 'deletion_checks': args.deletion_checks}
+            with open(args.report, 'a') as f:
+                f.write(json.dumps({'commit': current_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'settings': settings, 'report': report}) + "\n")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
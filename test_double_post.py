@@ -0,0 +1,56 @@
+# Compares posted_on_different_days with the way the double post rule used to be decided:
+# converting the posts to every timezone in pytz.common_timezones, until one puts them all on different days.
+# Run with: python -m pytest test_double_post.py
+
+from chickenbot import posted_on_different_days, all_timezone_transitions
+import pandas as pd
+import random
+import pytz
+
+def posted_on_different_days_with_timezone_loop(timestamps):
+    posts = pd.DataFrame({'timestamp': timestamps}, dtype=float)
+    posts["datetime"] = pd.to_datetime(posts["timestamp"], unit='s', utc=True)
+    for tz_name in pytz.common_timezones:
+        post_dates = posts["datetime"].dt.tz_convert(pytz.timezone(tz_name)).dt.date
+        if post_dates.is_unique:
+            return True
+    return False
+
+def earlier_posts(rng, timestamp):
+    # The timestamps of a new post and the (at most 2) posts of the same user before it.
+    # Most gaps are close to a day or half a day, where the rule is hardest to decide. Some are whole
+    # quarters of an hour, like the UTC offsets, so posts fall exactly on the start of a day somewhere.
+    gaps = [rng.choice([rng.randint(0, 100000), rng.randint(80000, 95000), rng.randint(30000, 60000), rng.randint(0, 200000), rng.randint(0, 220)*900])
+            for _ in range(rng.randint(0, 2))]
+    return [timestamp] + [timestamp - sum(gaps[:i+1]) for i in range(len(gaps))]
+
+def check_cases(cases):
+    mismatches = [timestamps for timestamps in cases
+                  if posted_on_different_days(timestamps) != posted_on_different_days_with_timezone_loop(timestamps)]
+    assert mismatches == []
+
+def test_random_posts():
+    rng = random.Random(6)
+    check_cases([earlier_posts(rng, rng.randint(1600000000, 1900000000)) for _ in range(150)])
+
+def test_posts_around_DST_transitions():
+    rng = random.Random(60)
+    transitions = [transition for transition in all_timezone_transitions() if 1600000000 < transition < 1900000000]
+    cases = [earlier_posts(rng, int(rng.choice(transitions)) + rng.randint(-100000, 100000)) for _ in range(100)]
+    for _ in range(300):
+        # Three posts within about a day: only a few UTC offsets put them on three different days,
+        # and a timezone that changes its offset in between might (no longer) be one of them
+        timestamp = int(rng.choice(transitions)) // 900 * 900 + rng.randint(-48, 48)*900
+        cases.append([timestamp, timestamp - rng.randint(8, 88)*900, timestamp - 86400 - rng.randint(-4, 8)*900])
+    check_cases(cases)
+
+def test_posts_exactly_on_day_boundaries():
+    # Posts at whole quarters of an hour in UTC, so they start or end a day in some timezones
+    rng = random.Random(600)
+    cases = []
+    for _ in range(60):
+        timestamp = rng.randint(1600000000, 1900000000) // 900 * 900
+        cases.append(earlier_posts(rng, timestamp))
+        cases.append([timestamp, timestamp - rng.randint(1, 96)*900])
+        cases.append([timestamp, timestamp - rng.randint(1, 96)*900, timestamp - rng.randint(97, 192)*900])
+    check_cases(cases)
\ No newline at end of file
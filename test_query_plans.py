@@ -0,0 +1,34 @@
+# Makes sure the queries the bot runs the most (HOT_QUERIES) keep using an index,
+# on a database created by setup_database (including all SCHEMA_MIGRATIONS).
+# Run with: python -m pytest test_query_plans.py
+
+from benchmark import FakeReddit, make_bot
+from chickenbot import HOT_QUERIES
+import contextlib
+import pytest
+import io
+
+@pytest.fixture
+def bot(tmp_path):
+    cb = make_bot(str(tmp_path / 'chicken_bot'), FakeReddit())
+    with contextlib.redirect_stdout(io.StringIO()):
+        cb.setup_database()
+    yield cb
+    cb.close_connection()
+
+@pytest.mark.parametrize('query, params', HOT_QUERIES)
+def test_hot_query_uses_index(bot, query, params):
+    bot.cursor().execute("EXPLAIN QUERY PLAN " + query, params)
+    plan = [row['detail'] for row in bot.cursor().fetchall()]
+    assert any('INDEX' in step for step in plan), plan
+    assert not any(step.startswith('SCAN') and 'INDEX' not in step for step in plan), plan
+
+def test_check_query_plans_finds_no_slow_queries(bot):
+    assert bot.check_query_plans() == []
+
+def test_check_query_plans_finds_missing_index(bot):
+    bot.cursor().execute("DROP INDEX deleted_posts_username")
+    # The plans sqlite has prepared on the connection still use the index
+    bot.close_connection()
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert bot.check_query_plans() == ["SELECT * FROM deleted_posts WHERE username = ?"]
\ No newline at end of file
@@ -0,0 +1,58 @@
+# Makes sure setup_database gives every database the same schema, whether it is new or created by an older version of the bot.
+# Run with: python -m pytest test_schema_migrations.py
+
+from benchmark import FakeReddit, make_bot
+from chickenbot import SCHEMA_MIGRATIONS
+import contextlib
+import sqlite3
+import io
+
+def set_up(db):
+    cb = make_bot(db, FakeReddit())
+    with contextlib.redirect_stdout(io.StringIO()):
+        cb.setup_database()
+    cb.close_connection()
+
+def schema(db):
+    conn = sqlite3.connect(db + '.db')
+    objects = conn.execute("SELECT type, name FROM sqlite_master ORDER BY name").fetchall()
+    columns = {name: sorted(column[1] for column in conn.execute(f"PRAGMA table_info({name})")) for kind, name in objects if kind == 'table'}
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return objects, columns, version
+
+def test_new_database_has_all_migrations(tmp_path):
+    db = str(tmp_path / 'new')
+    set_up(db)
+    assert schema(db)[2] == len(SCHEMA_MIGRATIONS)
+
+def test_database_without_migrations(tmp_path):
+    # The tables as the first version of the bot created them
+    db = str(tmp_path / 'old')
+    conn = sqlite3.connect(db + '.db')
+    conn.execute("CREATE TABLE chicken_posts (id TEXT PRIMARY KEY, username TEXT, timestamp INTEGER, approved BOOLEAN, title TEXT, current_streak INTEGER, current_COAD_streak INTEGER, upvotes INTEGER DEFAULT NULL, comments INTEGER DEFAULT NULL)")
+    conn.execute("CREATE TABLE COAD_posts (username TEXT PRIMARY KEY, post_id TEXT, streak INTEGER)")
+    conn.execute("INSERT INTO chicken_posts (id, username, timestamp, approved, title) VALUES ('a', 'user', 1700000000, 1, '12')")
+    conn.commit()
+    conn.close()
+    set_up(db)
+    new_db = str(tmp_path / 'new')
+    set_up(new_db)
+    assert schema(db) == schema(new_db)
+
+def test_database_that_already_has_some_columns(tmp_path):
+    # Before the migrations existed, setup_database added some of the columns by itself
+    db = str(tmp_path / 'old')
+    conn = sqlite3.connect(db + '.db')
+    conn.execute("CREATE TABLE chicken_posts (id TEXT PRIMARY KEY, username TEXT, timestamp INTEGER, approved BOOLEAN, title TEXT, current_streak INTEGER, current_COAD_streak INTEGER, upvotes INTEGER DEFAULT NULL, comments INTEGER DEFAULT NULL, statistics_updated INTEGER DEFAULT NULL, statistics_next_update INTEGER DEFAULT NULL, number INTEGER DEFAULT NULL)")
+    conn.execute("CREATE TABLE COAD_posts (username TEXT PRIMARY KEY, post_id TEXT, streak INTEGER, timestamp INTEGER)")
+    conn.execute("CREATE TABLE deleted_posts (id TEXT PRIMARY KEY, username TEXT, timestamp INTEGER)")
+    for statement in SCHEMA_MIGRATIONS[0]:
+        conn.execute(statement)
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+    set_up(db)
+    new_db = str(tmp_path / 'new')
+    set_up(new_db)
+    assert schema(db) == schema(new_db)
\ No newline at end of file
@@ -0,0 +1,111 @@
+# Compares streak_from_timestamps with the way the streaks used to be calculated:
+# converting the posts to every timezone in pytz.common_timezones, and walking back from the latest post in each of them.
+# Run with: python -m pytest test_streaks.py
+
+from chickenbot import streak_from_timestamps, all_timezone_transitions
+from datetime import datetime, timezone, timedelta
+import pandas as pd
+import random
+import pytz
+
+def streak_with_timezone_loop(post_timestamps, timestamp, last_COAD_timestamp = None, COAD_streak_number = 0):
+    df = pd.DataFrame({'timestamp': [post_timestamp for post_timestamp in post_timestamps if post_timestamp <= timestamp]}, dtype=float)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit='s', utc=True)
+    has_COAD_streak = last_COAD_timestamp is not None
+    if has_COAD_streak:
+        last_COAD_datetime = datetime.fromtimestamp(last_COAD_timestamp, tz=timezone.utc)
+
+    max_streak = 0
+    max_COAD_streak = 0
+    for tz_name in pytz.common_timezones:
+        tz = pytz.timezone(tz_name)
+        df["post_date"] = df["timestamp"].dt.tz_convert(tz).dt.date
+        df = df.sort_values("post_date", ascending = False)
+        if has_COAD_streak:
+            last_COAD_date = last_COAD_datetime.astimezone(tz).date()
+
+        streak = 0
+        COAD_streak = 0
+        last_date = None
+        today_datetime = datetime.fromtimestamp(timestamp, tz=tz)
+        today = today_datetime.date()
+        yesterday = (today_datetime - timedelta(days=1)).date()
+        if has_COAD_streak and (last_COAD_date == today or last_COAD_date == yesterday):
+            COAD_streak = COAD_streak_number
+
+        for date in df["post_date"]:
+            if (date == today or date == yesterday) and last_date is None:
+                streak = 1
+                last_date = date
+            elif last_date is not None:
+                if date == last_date - timedelta(days=1):
+                    if has_COAD_streak and date == last_COAD_date:
+                        COAD_streak = COAD_streak_number + streak
+                    streak += 1
+                    last_date = date
+                else:
+                    break
+            else:
+                streak = 0
+                break
+        if has_COAD_streak and last_date is not None and last_COAD_date == last_date - timedelta(days=1):
+            COAD_streak = COAD_streak_number + streak
+        max_streak = max(max_streak, streak)
+        if has_COAD_streak:
+            max_COAD_streak = max(max_COAD_streak, COAD_streak)
+    return max_streak, max_COAD_streak
+
+def post_history(rng, end):
+    # The posts of a user that posts about once a day, going back from end. Some days are missed,
+    # some posts are only a few hours apart, and some are close to a day apart, where the timezone matters.
+    timestamps = []
+    timestamp = end - rng.randint(0, 2*86400)
+    for _ in range(rng.randint(0, 40)):
+        timestamps.append(timestamp)
+        if rng.random() < 0.8:
+            timestamp -= 86400 + rng.randint(-10000, 10000)
+        else:
+            timestamp -= rng.choice([rng.randint(60000, 110000), rng.randint(0, 20000), 2*86400 + rng.randint(-20000, 20000)])
+    return timestamps
+
+def COAD_info(rng, timestamps, end):
+    # Half of the users carried over a streak, from a COAD post made around one of their recent posts
+    if rng.random() < 0.5:
+        return ()
+    anchor = rng.choice(timestamps[:15]) if timestamps else end
+    return (anchor - rng.randint(-20000, 130000), rng.randint(1, 500))
+
+def check_cases(cases):
+    mismatches = [case for case in cases if streak_from_timestamps(*case) != streak_with_timezone_loop(*case)]
+    assert mismatches == []
+
+def test_random_users():
+    rng = random.Random(1)
+    cases = []
+    for _ in range(60):
+        end = rng.randint(1600000000, 1900000000)
+        timestamps = post_history(rng, end)
+        cases.append((timestamps, end, *COAD_info(rng, timestamps, end)))
+    check_cases(cases)
+
+def test_users_around_DST_transitions():
+    # The streaks that run across a change of UTC offset, and those that end right around one
+    rng = random.Random(10)
+    transitions = [transition for transition in all_timezone_transitions() if 1600000000 < transition < 1900000000]
+    cases = []
+    for _ in range(60):
+        end = int(rng.choice(transitions)) + rng.randint(-3*86400, 20*86400)
+        timestamps = post_history(rng, end)
+        cases.append((timestamps, end, *COAD_info(rng, timestamps, end)))
+    check_cases(cases)
+
+def test_streaks_at_an_earlier_moment():
+    # Only the posts up to the given moment count (like record_post_streak does for every post)
+    rng = random.Random(100)
+    cases = []
+    for _ in range(30):
+        end = rng.randint(1600000000, 1900000000)
+        timestamps = post_history(rng, end)
+        moment = rng.choice(timestamps) if timestamps else end
+        cases.append((timestamps, moment, *COAD_info(rng, timestamps, end)))
+    check_cases(cases)
\ No newline at end of file
@@ -10,19 +10,20 @@ from chickenbot import ChickenBot
 import time
 
 cb = ChickenBot()
-cb.update_target_post(40)
+cb.update_target_post()
 
 while True:
     try:
-        for submission in cb.subreddit.stream.submissions(skip_existing=True):
-            while True:
-                try:
-                    cb.update_target_post()
-                    break
-                except Exception as e:
-                    print(f"Error in execution: {e}")
-                    cb.close_connection()
-                    time.sleep(30)
+        with cb.api_priority('moderation'):
+            for submission in cb.subreddit.stream.submissions(skip_existing=True):
+                while True:
+                    try:
+                        cb.update_target_post()
+                        break
+                    except Exception as e:
+                        print(f"Error in execution: {e}")
+                        cb.close_connection()
+                        time.sleep(30)
 
     except Exception as e:
         print(f"Error in submission stream: {e}")
@@ -6,36 +6,22 @@ import time
 
 cb = ChickenBot()
 
-def update_count_leaderboard():
-    cb.update_count_leaderboard()
-
-def update_whole_counts_leaderboard():    
-    cb.update_whole_counts_leaderboard()
+def update_hourly_leaderboards():
+    # The count, whole counts, identical digits, streak and palindrome leaderboards, built from one snapshot
+    cb.update_hourly_leaderboards()
 
 def update_top_posts_leaderboards():
     cb.update_top_posts_leaderboards()
 
-def update_identical_digits_leaderboard():
-    cb.update_identical_digits_leaderboard()
-
-def update_palindrome_leaderboard():
-    cb.update_palindrome_leaderboard()
-
-def update_streak_leaderboard():
-    cb.update_streak_leaderboard()
+def record_post_statistics():
+    # Only the posts that are due are refreshed, see ChickenBot.record_post_statistics
+    cb.record_post_statistics()
 
-schedule.every(1).hour.do(update_count_leaderboard)
-schedule.every(1).hour.do(update_whole_counts_leaderboard)
-schedule.every(1).hour.do(update_identical_digits_leaderboard)
-schedule.every(1).hour.do(update_streak_leaderboard)
-schedule.every(1).hour.do(update_palindrome_leaderboard)
+schedule.every(1).hour.do(update_hourly_leaderboards)
+schedule.every(1).hour.do(record_post_statistics)
 schedule.every(1).day.do(update_top_posts_leaderboards)
 
-update_count_leaderboard()
-update_whole_counts_leaderboard()
-update_identical_digits_leaderboard()
-update_streak_leaderboard()
-update_palindrome_leaderboard()
+update_hourly_leaderboards()
 update_top_posts_leaderboards()
 
 while True:
@@ -1,16 +1,19 @@
 # If someone (including moderators) deletes a post within 10 minute of posting it,
-# it doesn't count for the streak. This script checks this every 15 seconds.
+# it doesn't count for the streak. This script checks this every 15 seconds:
+# removals by moderators are read from the mod log, and every post is checked
+# once by itself, shortly before its 10 minutes are over (see DeletionWatcher).
 # Furthermore, this script updates the streaks of people every hour. For example,
 # if someone hasn't posted in a full day, their streak will be set to 0 again.
 
-from chickenbot import ChickenBot
+from chickenbot import ChickenBot, DeletionWatcher
 import schedule
 import time
 
 cb = ChickenBot()
+watcher = DeletionWatcher(cb)
 
 def check_for_deleted_posts():
-    cb.check_for_deleted_posts()
+    watcher.step()
 
 schedule.every(15).seconds.do(check_for_deleted_posts)
 
@@ -6,22 +6,38 @@
 from chickenbot import ChickenBot
 import schedule
 import time
+import os
 
-cb = ChickenBot()
+# Number of processes used to calculate the streaks of all users
+STREAK_PROCESSES = os.cpu_count() or 1
 
-def extra_streak_check():
-    cb.record_empty_post_streaks()
-    cb.record_all_streaks()
-    cb.update_all_flair()
+# The streaks are calculated in separate processes, which import this file again.
+# The guard makes sure those processes don't start a bot of their own.
+if __name__ == "__main__":
+    cb = ChickenBot()
 
-schedule.every(1).hour.do(extra_streak_check)
+    def extra_streak_check():
+        # Only the flairs of users whose streak has changed are updated
+        cb.record_empty_post_streaks()
+        changed_users = cb.record_all_streaks(processes=STREAK_PROCESSES)
+        cb.update_all_flair(changed_users)
 
-# Run the first check immediately
-extra_streak_check()
+    def full_flair_check():
+        # Flairs can also be changed by users and moderators, or have been missed while the bot was down.
+        # That's why all flairs are checked once per day.
+        cb.record_empty_post_streaks()
+        cb.record_all_streaks(processes=STREAK_PROCESSES)
+        cb.update_all_flair()
 
-while True:
-    try:
-        schedule.run_pending()
-        time.sleep(1)
-    except Exception as e:
-        print(e)
\ No newline at end of file
+    schedule.every(1).hour.do(extra_streak_check)
+    schedule.every(1).day.do(full_flair_check)
+
+    # Run the first check immediately
+    full_flair_check()
+
+    while True:
+        try:
+            schedule.run_pending()
+            time.sleep(1)
+        except Exception as e:
+            print(e)
\ No newline at end of file